@@ -8,14 +8,59 @@ load_dotenv()
 SSH_HOST = os.getenv('SSH_HOST', '')
 SSH_USER = os.getenv('SSH_USER', '')
 SSH_KEY_PATH = os.getenv('SSH_KEY_PATH', '')
+SSH_CONNECT_TIMEOUT = float(os.getenv('SSH_CONNECT_TIMEOUT', '15'))
+SSH_KEEPALIVE_INTERVAL = int(os.getenv('SSH_KEEPALIVE_INTERVAL', '30'))
+SSH_POOL_MAX_SIZE = int(os.getenv('SSH_POOL_MAX_SIZE', '4'))
+SSH_POOL_IDLE_TIMEOUT = float(os.getenv('SSH_POOL_IDLE_TIMEOUT', '300'))
+
+MUTATION_BATCH_WINDOW = float(os.getenv('MUTATION_BATCH_WINDOW', '0.05'))
+MUTATION_BATCH_MAX_SIZE = int(os.getenv('MUTATION_BATCH_MAX_SIZE', '100'))
+SLOT_RESERVATION_TTL = float(os.getenv('SLOT_RESERVATION_TTL', '300'))
 
 WG_PRESHARED_KEY = os.getenv('WG_PRESHARED_KEY', '')
 
 XRAY_CONTAINER = os.getenv('XRAY_CONTAINER', 'amnezia-xray')
 WG_CONTAINER = os.getenv('WG_CONTAINER', 'amnezia-awg')
 
+XRAY_API_PORT = int(os.getenv('XRAY_API_PORT', '10085'))
+XRAY_INBOUND_TAG = os.getenv('XRAY_INBOUND_TAG', 'vless-inbound')
+XRAY_GRPC_TIMEOUT = float(os.getenv('XRAY_GRPC_TIMEOUT', '5'))
+XRAY_GRPC_KEEPALIVE_MS = int(os.getenv('XRAY_GRPC_KEEPALIVE_MS', '30000'))
+# лишние пользователи Xray моложе этого срока (в секундах) не удаляются: их запись в БД может ещё создаваться
+RECONCILE_GRACE_PERIOD = float(os.getenv('RECONCILE_GRACE_PERIOD', '600'))
+
 CONFIG_PATH_XRAY = os.getenv('CONFIG_PATH_XRAY', '/opt/amnezia/xray/')
 CONFIG_PATH_WG = os.getenv('CONFIG_PATH_WG', '/opt/amnezia/awg/')
 
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv('USER_CACHE_NEGATIVE_TTL', '30'))
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '10000'))
+
+# обработка апдейтов: всего одновременно и сколько апдейтов одного пользователя может ждать очереди.
+# Очерёдность и дедупликация работают в пределах процесса, поэтому при UPDATE_SERIALIZE webhook запускается
+# одним воркером независимо от WEBHOOK_WORKERS
+UPDATE_SERIALIZE = os.getenv('UPDATE_SERIALIZE', 'true').lower() in ['true', '1', 't']
+UPDATE_MAX_CONCURRENCY = int(os.getenv('UPDATE_MAX_CONCURRENCY', '100'))
+UPDATE_USER_QUEUE_LIMIT = int(os.getenv('UPDATE_USER_QUEUE_LIMIT', '5'))
+
+# лимиты запросов в формате «запросов/секунд»: на пользователя и на всех вместе
+RATE_LIMIT_PROVISION_USER = os.getenv('RATE_LIMIT_PROVISION_USER', '3/60')
+RATE_LIMIT_PROVISION_GLOBAL = os.getenv('RATE_LIMIT_PROVISION_GLOBAL', '30/10')
+RATE_LIMIT_FETCH_USER = os.getenv('RATE_LIMIT_FETCH_USER', '10/60')
+RATE_LIMIT_FETCH_GLOBAL = os.getenv('RATE_LIMIT_FETCH_GLOBAL', '60/10')
+# хранить корзины в БД: лимиты переживают перезапуск и общие для воркеров webhook
+# (при нескольких воркерах webhook включается автоматически)
+RATE_LIMIT_PERSIST = os.getenv('RATE_LIMIT_PERSIST', 'false').lower() in ['true', '1', 't']
+
 MAIN_ADMIN_ID = os.getenv('MAIN_ADMIN_ID', '')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
+
+# polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')  # noqa: S104
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
@@ -3,6 +3,7 @@ from asgiref.sync import sync_to_async
 from vpn.models.configs import VPNUser
 
 from telegram_bot import bot
+from telegram_bot.middleware.user_cache import user_cache
 
 
 router = Router()
@@ -14,8 +15,15 @@ async def admin_approve_reject(cq: types.CallbackQuery):
     user = await sync_to_async(VPNUser.objects.get)(telegram_id=int(tg_id))
     if action == 'admin_approve':
         user.is_active = True
+        # save() через post_save сбрасывает пользователя в кэше авторизации, сбрасываем и явно на случай update()
         await sync_to_async(user.save)()
-        await cq.message.edit_text(f'✅ Доступ одобрен для {user.full_name} (ID={tg_id})')
+        user_cache.invalidate(user.telegram_id)
+        text = f'✅ Доступ одобрен для {user.full_name} (ID={tg_id})'
+        if user.config_sync_failures:
+            text += '\n⚠️ Не удалось применить изменения конфигов на серверах: ' + ', '.join(
+                server.name for server in user.config_sync_failures
+            )
+        await cq.message.edit_text(text)
         await bot.send_message(tg_id, '✅ Ваш доступ к боту одобрен.')
     else:
         await cq.message.edit_text(f'❌ Доступ отклонён для {user.full_name} (ID={tg_id})')
@@ -1,16 +1,21 @@
+import contextlib
 import logging
-import os
+import math
 from datetime import datetime
 
 from aiogram import Router, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from asgiref.sync import sync_to_async
 from vpn.models.configs import MODEL_MAP, AmneziaWGConfig, VLESSConfig, VPNUser
+from vpn.models.jobs import ProvisioningJob
+from vpn.models.users import ConfigSummary
+from vpn.utils.provisioning_utils import wg_conf_filename
 
 from telegram_bot import bot
-from telegram_bot.helpers.config_generator import generate_vless_config, generate_wg_config
+from telegram_bot.helpers.config_generator import enqueue_config, request_config
 
 
 router = Router()
@@ -20,14 +25,7 @@ logger = logging.getLogger(__name__)
 @router.message(Command('getconfig'))
 async def get_vless_handler(message: types.Message, user: VPNUser, expires: datetime | None = None):
     """Обработчик команды /getconfig для получения VLESS-конфига."""
-
-    progress_message = await message.answer('🔄 Генерируем VLESS-конфиг...')
-
-    try:
-        text, _ = await generate_vless_config(user, expires)
-        await progress_message.edit_text(text, parse_mode='Markdown')
-    except ValueError as e:
-        await progress_message.edit_text(str(e))
+    await request_config(message, user, ProvisioningJob.VLESS, expires)
 
 
 # XXX Отказываемся от поддержки AmneziaWG,
@@ -35,69 +33,85 @@ async def get_vless_handler(message: types.Message, user: VPNUser, expires: date
 # @router.message(Command('getwg'))
 async def get_wg_handler(message: types.Message, user: VPNUser, expires: datetime | None = None):
     """Обработчик команды /getwg для получения AmneziaWG-конфига."""
+    await request_config(message, user, ProvisioningJob.AMNEZIAWG, expires)
 
-    progress_message = await message.answer('🔄 Генерируем AmneziaWG-конфиг...')
 
-    try:
-        text, wg_config = await generate_wg_config(user, expires)
-        await progress_message.delete()
-        await bot.send_document(
-            chat_id=message.from_user.id,
-            document=FSInputFile(wg_config.tmp_filepath),
-            caption=text,
+CONFIGS_PAGE_SIZE = 5
+
+
+def render_configs_page(configs: list[ConfigSummary], page: int) -> tuple[str, types.InlineKeyboardMarkup]:
+    """Текст и клавиатура одной страницы списка конфигов. Номер страницы приводится к допустимому."""
+    pages = math.ceil(len(configs) / CONFIGS_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    start = page * CONFIGS_PAGE_SIZE
+
+    blocks, kb, row_sizes = [], InlineKeyboardBuilder(), []
+    for number, cfg in enumerate(configs[start : start + CONFIGS_PAGE_SIZE], start=start + 1):
+        title = '🔐 *AmneziaWG*' if cfg.model_name == 'AmneziaWGConfig' else '🔑 *VLESS*'
+        blocks.append(
+            f'{number}. {title}\n'
+            f'ID: `{cfg.client_id}`\n'
+            f'Сервер: {cfg.server_name}\n'
+            f'Истекает: {cfg.expires_at:%d-%m-%Y}\n'
+            f'Статус: {"✅ Активен" if cfg.is_active else "❌ Неактивен"}',
+        )
+        if cfg.model_name == 'AmneziaWGConfig':
+            kb.button(text=f'🔄 Сменить протокол #{number}', callback_data=f'change_proto:{cfg.model_name}:{cfg.id}')
+        else:
+            kb.button(text=f'⏱ Продлить #{number}', callback_data=f'extend_config:{cfg.id}')
+        # XXX Отключено до реализации отдельной модели для покупки,
+        # чтобы при удалении и создании дата истечения не менялась
+        # kb.button(text=f'❌ Удалить #{number}', callback_data=f'delete_config:{cfg.model_name}:{cfg.id}')  # noqa: ERA001
+        kb.button(text=f'📋 Получить #{number}', callback_data=f'get_config:{cfg.model_name}:{cfg.id}')
+        row_sizes.append(2)
+
+    text = '\n\n'.join(blocks)
+    if any(cfg.model_name == 'AmneziaWGConfig' for cfg in configs[start : start + CONFIGS_PAGE_SIZE]):
+        text += (
+            '\n\n*Важно!*\nAmneziaWG блокируется в России, измените '
+            'свои AmneziaWG протоколы на VLESS, нажав кнопку под списком.'
         )
-        try:
-            os.remove(wg_config.tmp_filepath)
-        except OSError:
-            logger.exception('Не удалось удалить временный файл %s', wg_config.tmp_filepath)
-    except ValueError as e:
-        await progress_message.edit_text(str(e))
+
+    if pages > 1:
+        kb.button(text='◀️', callback_data=f'configs_page:{page - 1 if page else pages - 1}')
+        kb.button(text=f'{page + 1}/{pages}', callback_data='configs_page:noop')
+        kb.button(text='▶️', callback_data=f'configs_page:{(page + 1) % pages}')
+        row_sizes.append(3)
+    kb.adjust(*row_sizes)
+    return text, kb.as_markup()
 
 
 @router.message(Command('configs'))
 async def list_configs(message: types.Message, user: VPNUser):
-    configs = await sync_to_async(lambda: user.configs)()
+    """Все конфиги пользователя одним сообщением с постраничной навигацией."""
+    configs = await sync_to_async(user.config_summaries)()
     if not configs:
         return await message.answer('У вас пока нет конфигов.')
 
-    # Для каждого конфига выводим отдельное сообщение с кнопкой
-    for cfg in configs:
-        kb = InlineKeyboardBuilder()
-        if isinstance(cfg, AmneziaWGConfig):
-            kb.button(text='🔄 Сменить протокол', callback_data=f'change_proto:{cfg.__class__.__name__}:{cfg.id}')
-        else:
-            kb.button(text='⏱ Продлить', callback_data=f'extend_config:{cfg.id}')
-        # XXX Отключено до реализации отдельной модели для покупки,
-        # чтобы при удалении и создании дата истечения не менялась
-        # kb.button(text='❌ Удалить', callback_data=f'delete_config:{cfg.__class__.__name__}:{cfg.id}')  # noqa: ERA001
-        kb.button(text='📋 Получить конфиг', callback_data=f'get_config:{cfg.__class__.__name__}:{cfg.id}')
-        kb.adjust(1, 2)
-
-        server_name = await sync_to_async(lambda: cfg.server.name)()  # noqa: B023
-
-        # кратко описываем конфиг
-        if isinstance(cfg, AmneziaWGConfig):
-            text = (
-                f'🔐 *AmneziaWG*\n'
-                f'ID: `{cfg.client_id}`\n'
-                f'Сервер: {server_name}\n'
-                f'Истекает: {cfg.expires_at:%d-%m-%Y}\n'
-                f'Статус: {"✅ Активен" if cfg.is_active else "❌ Неактивен"}'
-                f'**\n\n*Важно!*\nAmneziaWG блокируется в России, измените '
-                f'свои AmneziaWG протоколы на VLESS, нажав кнопку под конфигом.'
-            )
-        elif isinstance(cfg, VLESSConfig):
-            text = (
-                f'🔑 *VLESS*\n'
-                f'ID: `{cfg.client_id}`\n'
-                f'Сервер: {server_name}\n'
-                f'Истекает: {cfg.expires_at:%d-%m-%Y}\n'
-                f'Статус: {"✅ Активен" if cfg.is_active else "❌ Неактивен"}'
-            )
+    text, markup = render_configs_page(configs, 0)
+    await message.answer(text, parse_mode='Markdown', reply_markup=markup)
+    return None
 
-        await message.answer(text, parse_mode='Markdown', reply_markup=kb.as_markup())
 
-    return None
+@router.callback_query(lambda c: c.data and c.data.startswith('configs_page:'))
+async def configs_page_cb(cq: types.CallbackQuery, user: VPNUser):
+    page = cq.data.split(':')[1]
+    if page == 'noop':
+        await cq.answer()
+        return
+
+    # перечитываем список: конфиги могли измениться с момента его отправки
+    configs = await sync_to_async(user.config_summaries)()
+    if not configs:
+        await cq.message.edit_text('У вас пока нет конфигов.')
+        await cq.answer()
+        return
+
+    text, markup = render_configs_page(configs, int(page))
+    # «message is not modified» — на странице ничего не изменилось
+    with contextlib.suppress(TelegramBadRequest):
+        await cq.message.edit_text(text, parse_mode='Markdown', reply_markup=markup)
+    await cq.answer()
 
 
 @router.callback_query(lambda c: c.data and c.data.startswith('change_proto:'))
@@ -141,24 +155,8 @@ async def confirm_change_protocol_cb(cq: types.CallbackQuery, user: VPNUser):
 
     await cq.message.edit_text('🔄 Генерируем новый конфиг...')
 
-    try:
-        if model_name == 'AmneziaWGConfig':
-            text, _ = await generate_vless_config(user, expires)
-            await cq.message.edit_text(text, parse_mode='Markdown')
-        else:
-            text, wg_config = await generate_wg_config(user, expires)
-            await cq.message.edit_text('✅ Конфиг успешно создан')
-            await bot.send_document(
-                chat_id=cq.from_user.id,
-                document=FSInputFile(wg_config.tmp_filepath),
-                caption=text,
-            )
-            try:
-                os.remove(wg_config.tmp_filepath)
-            except OSError:
-                logger.exception('Не удалось удалить временный файл %s', wg_config.tmp_filepath)
-    except ValueError as e:
-        await cq.message.edit_text(str(e))
+    kind = ProvisioningJob.VLESS if model_name == 'AmneziaWGConfig' else ProvisioningJob.AMNEZIAWG
+    await enqueue_config(user, kind, f'change_proto:{model_name}:{config_id}', cq.message, expires)
 
 
 @router.callback_query(lambda c: c.data == 'cancel_change')
@@ -189,26 +187,20 @@ async def delete_config_cb(cq: types.CallbackQuery, user: VPNUser):
 async def get_config_cb(cq: types.CallbackQuery, user: VPNUser):
     _, model_name, config_id = cq.data.split(':')
     Model = MODEL_MAP[model_name]  # noqa: N806
-    config = await sync_to_async(Model.objects.get)(pk=config_id, user=user)
+    config = await sync_to_async(Model.objects.select_related('server', 'user').get)(pk=config_id, user=user)
 
     try:
-        await cq.message.edit_text('🔄 Получаем информацию о конфиге...')
+        # конфиг отправляем отдельным сообщением, список /configs остаётся
         if isinstance(config, VLESSConfig):
             _, vless_url = await sync_to_async(config.get_vless_url)()
-            await cq.message.delete()
             await cq.message.answer(f'✅ Ваш VLESS-конфиг:\n```\n{vless_url}\n```', parse_mode='Markdown')
         elif isinstance(config, AmneziaWGConfig):
-            tmp_filepath = await sync_to_async(config.get_existing_config)()
-            await cq.message.delete()
+            conf = await sync_to_async(config.get_existing_config)()
             await bot.send_document(
                 chat_id=cq.from_user.id,
-                document=FSInputFile(tmp_filepath),
+                document=BufferedInputFile(conf, filename=wg_conf_filename(user)),
                 caption='✅ Ваш AmneziaWG-конфиг',
             )
-            try:
-                os.remove(tmp_filepath)
-            except OSError:
-                logger.exception('Не удалось удалить временный файл %s', tmp_filepath)
 
         await cq.answer()
     except Exception:
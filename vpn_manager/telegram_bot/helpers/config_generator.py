@@ -1,34 +1,42 @@
 import logging
 from datetime import datetime
 
-from django.forms import ValidationError
-from vpn.models.configs import AmneziaWGConfig, VLESSConfig, VPNUser
+from aiogram import types
+from asgiref.sync import sync_to_async
+from vpn.models.jobs import ProvisioningJob
+from vpn.models.users import VPNUser
 
 
 logger = logging.getLogger(__name__)
 
 
-async def generate_vless_config(user: VPNUser, expires: datetime | None = None) -> tuple[str, VLESSConfig]:
-    """Создает VLESS конфиг для пользователя."""
-    try:
-        vless_config = await VLESSConfig.objects.acreate(user=user, expires_at=expires)
-    except ValidationError as e:
-        raise ValueError(f'🛑 Лимит конфигов ({user.available_configs_count}) исчерпан.') from e
-    except Exception as e:
-        logger.exception('Ошибка при создании VLESS-конфига')
-        raise ValueError('❌ Не удалось создать VLESS-конфиг. Попробуйте позже.') from e
-    else:
-        return f'✅ Ваш новый VLESS-конфиг:\n```\n{vless_config.generated_url}\n```', vless_config
-
-
-async def generate_wg_config(user: VPNUser, expires: datetime | None = None) -> tuple[str, AmneziaWGConfig]:
-    """Создает WireGuard конфиг для пользователя."""
-    try:
-        wg_config = await AmneziaWGConfig.objects.acreate(user=user, expires_at=expires)
-    except ValidationError as e:
-        raise ValueError(f'🛑 Лимит конфигов ({user.available_configs_count}) исчерпан.') from e
-    except Exception as e:
-        logger.exception('Ошибка при создании AmneziaWG-конфига')
-        raise ValueError('❌ Не удалось создать AmneziaWG-конфиг. Попробуйте позже.') from e
-    else:
-        return '✅ Ваш новый AmneziaWG-конфиг', wg_config
+async def enqueue_config(
+    user: VPNUser,
+    kind: str,
+    idempotency_key: str,
+    progress_message: types.Message,
+    expires: datetime | None = None,
+) -> ProvisioningJob:
+    """Поставить выдачу конфига в очередь. Воркер заменит `progress_message` готовым конфигом."""
+    job, created = await sync_to_async(ProvisioningJob.enqueue)(
+        user,
+        kind,
+        idempotency_key,
+        expires_at=expires,
+        chat_id=progress_message.chat.id,
+        message_id=progress_message.message_id,
+    )
+    if not created:
+        logger.info('Задача %s уже поставлена в очередь', idempotency_key)
+    return job
+
+
+async def request_config(message: types.Message, user: VPNUser, kind: str, expires: datetime | None = None):
+    """Ответить на команду получения конфига и поставить его выдачу в очередь."""
+    if await sync_to_async(ProvisioningJob.active_for)(user, kind):
+        await message.answer('⏳ Конфиг уже готовится, мы пришлём его, как только он будет готов.')
+        return
+
+    progress_message = await message.answer(f'🔄 Генерируем {ProvisioningJob(kind=kind).get_kind_display()}...')  # type: ignore[attr-defined]
+    # ключ по исходному сообщению: повторная доставка того же апдейта не создаст второй конфиг
+    await enqueue_config(user, kind, f'{kind}:{message.chat.id}:{message.message_id}', progress_message, expires)
@@ -2,10 +2,13 @@ import asyncio
 import logging
 import os
 import sys
+from multiprocessing import Process
 from pathlib import Path
 
 from aiogram import Bot
 from aiogram.types import BotCommand
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -16,13 +19,40 @@ import django  # noqa: E402, I001
 django.setup()
 
 
+from config.env_constants import (  # noqa: E402
+    BOT_MODE,
+    RATE_LIMIT_PERSIST,
+    UPDATE_SERIALIZE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+)
+
 from telegram_bot import bot, dp  # noqa: E402
 from telegram_bot.handlers import access_control, admin, config_manager, help_handler, start  # noqa: E402
 from telegram_bot.middleware.authorization import AuthorizationMiddleware  # noqa: E402
+from telegram_bot.middleware.rate_limit import RateLimitMiddleware  # noqa: E402
+from telegram_bot.middleware.user_scheduler import UserSerialMiddleware  # noqa: E402
+
+
+logger = logging.getLogger(__name__)
 
+# апдейты одного пользователя не должны попадать в разные процессы, поэтому с UPDATE_SERIALIZE воркер один
+BOT_PROCESSES = 1 if BOT_MODE != 'webhook' or UPDATE_SERIALIZE else max(WEBHOOK_WORKERS, 1)
 
+if UPDATE_SERIALIZE:
+    dp.update.outer_middleware(UserSerialMiddleware())
 dp.message.middleware(AuthorizationMiddleware())
 dp.callback_query.middleware(AuthorizationMiddleware())
+# после авторизации: незарегистрированные не расходуют лимиты, повторы уже отсеял UserSerialMiddleware
+# каждый воркер webhook — отдельный процесс: общие лимиты возможны только через БД
+rate_limit = RateLimitMiddleware(persist=RATE_LIMIT_PERSIST or BOT_PROCESSES > 1)
+dp.message.middleware(rate_limit)
+dp.callback_query.middleware(rate_limit)
 
 
 async def set_main_menu(bot: Bot):
@@ -34,13 +64,71 @@ async def set_main_menu(bot: Bot):
     await bot.set_my_commands(commands)
 
 
+def setup_dispatcher():
+    dp.include_routers(access_control.router, config_manager.router, admin.router, help_handler.router, start.router)
+
+
 async def main():
     await set_main_menu(bot)
-    dp.include_routers(access_control.router, config_manager.router, admin.router, help_handler.router, start.router)
+    setup_dispatcher()
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
 
+async def health(_: web.Request) -> web.Response:
+    return web.json_response({'status': 'ok'})
+
+
+def build_webhook_app() -> web.Application:
+    """aiohttp-приложение, принимающее апдейты Telegram на WEBHOOK_PATH."""
+    setup_dispatcher()
+    app = web.Application()
+    app.router.add_get('/health', health)
+    # handle_in_background: Telegram сразу получает 200, а апдейт обрабатывается отдельной задачей,
+    # поэтому всплеск ответов не копится в очереди на стороне Telegram
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=True).register(
+        app,
+        path=WEBHOOK_PATH,
+    )
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def register_webhook():
+    await set_main_menu(bot)
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        drop_pending_updates=True,
+    )
+    await bot.session.close()
+
+
+def serve_webhook(*, reuse_port: bool = True):
+    # при нескольких воркерах все процессы слушают один порт через SO_REUSEPORT, ядро распределяет соединения
+    web.run_app(build_webhook_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=reuse_port)
+
+
+def run_webhook():
+    if not WEBHOOK_BASE_URL or not WEBHOOK_SECRET:
+        raise RuntimeError('Для режима webhook нужны WEBHOOK_BASE_URL и WEBHOOK_SECRET')
+    asyncio.run(register_webhook())
+    if BOT_PROCESSES < WEBHOOK_WORKERS:
+        logger.warning('UPDATE_SERIALIZE включён: webhook запускается одним воркером вместо %s', WEBHOOK_WORKERS)
+    if BOT_PROCESSES == 1:
+        serve_webhook(reuse_port=False)
+        return
+    workers = [Process(target=serve_webhook, name=f'webhook-{i}') for i in range(BOT_PROCESSES)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    asyncio.run(main())
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
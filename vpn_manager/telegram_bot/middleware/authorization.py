@@ -1,7 +1,7 @@
 from aiogram import BaseMiddleware, types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from asgiref.sync import sync_to_async
-from vpn.models.users import VPNUser
+from telegram_bot.middleware.user_cache import CachedUser, UserStatus, resolve_user, user_cache
 
 
 class AuthorizationMiddleware(BaseMiddleware):
@@ -11,19 +11,23 @@ class AuthorizationMiddleware(BaseMiddleware):
         if isinstance(event, types.CallbackQuery) and event.data == 'request_access':
             return await handler(event, data)
 
-        try:
-            user = await sync_to_async(VPNUser.objects.get)(telegram_id=tg_id, is_active=True)
-            data['user'] = user
+        status = user_cache.get(tg_id)
+        if status is None:
+            status = await sync_to_async(resolve_user)(tg_id)
+            user_cache.set(tg_id, status)
+
+        if isinstance(status, CachedUser):
+            data['user'] = status.instance()
             return await handler(event, data)
-        except VPNUser.DoesNotExist:
-            try:
-                await sync_to_async(VPNUser.objects.get)(telegram_id=tg_id)
-                await event.answer('❌ Ваш аккаунт был деактивирован администратором.')
-            except VPNUser.DoesNotExist:
-                # Показываем кнопку пользователю
-                kb = InlineKeyboardBuilder()
-                kb.button(text='🔓 Запросить доступ', callback_data='request_access')
-                await event.answer(
-                    '❌ Вы не зарегистрированы.\n\nНажмите кнопку ниже, чтобы отправить запрос на доступ.',
-                    reply_markup=kb.as_markup(),
-                )
+
+        if status is UserStatus.INACTIVE:
+            await event.answer('❌ Ваш аккаунт был деактивирован администратором.')
+        else:
+            # Показываем кнопку пользователю
+            kb = InlineKeyboardBuilder()
+            kb.button(text='🔓 Запросить доступ', callback_data='request_access')
+            await event.answer(
+                '❌ Вы не зарегистрированы.\n\nНажмите кнопку ниже, чтобы отправить запрос на доступ.',
+                reply_markup=kb.as_markup(),
+            )
+        return None
@@ -0,0 +1,104 @@
+import logging
+import math
+from dataclasses import dataclass
+from datetime import timedelta
+
+from aiogram import BaseMiddleware, types
+from asgiref.sync import sync_to_async
+from config.env_constants import (
+    RATE_LIMIT_FETCH_GLOBAL,
+    RATE_LIMIT_FETCH_USER,
+    RATE_LIMIT_PERSIST,
+    RATE_LIMIT_PROVISION_GLOBAL,
+    RATE_LIMIT_PROVISION_USER,
+)
+from vpn.utils.rate_limit_utils import BucketSpec, DBRateLimiter, MemoryRateLimiter
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Лимит на группу команд и callback'ов. Префиксы одной группы расходуют общие корзины."""
+
+    name: str
+    prefixes: tuple[str, ...]
+    per_user: BucketSpec
+    total: BucketSpec | None = None
+
+    def matches(self, key: str) -> bool:
+        return key.startswith(self.prefixes)
+
+
+# каждая из этих команд открывает SSH к VPN-серверу
+RATE_LIMIT_RULES = (
+    RateLimitRule(
+        'provision',
+        ('/getconfig', 'confirm_change:'),
+        BucketSpec.parse(RATE_LIMIT_PROVISION_USER),
+        BucketSpec.parse(RATE_LIMIT_PROVISION_GLOBAL),
+    ),
+    RateLimitRule(
+        'fetch',
+        ('get_config:',),
+        BucketSpec.parse(RATE_LIMIT_FETCH_USER),
+        BucketSpec.parse(RATE_LIMIT_FETCH_GLOBAL),
+    ),
+)
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Token bucket на пользователя и общий для команд из `rules`; при превышении отвечает, когда повторить.
+
+    Корзины в памяти действуют в пределах процесса: с несколькими процессами бота нужен `persist`,
+    иначе фактический лимит умножается на число процессов.
+    """
+
+    def __init__(self, rules: tuple[RateLimitRule, ...] = RATE_LIMIT_RULES, *, persist: bool = RATE_LIMIT_PERSIST):
+        self.rules = rules
+        self.persist = persist
+        self.limited = 0
+        self._memory = MemoryRateLimiter()
+        longest = max(spec.period for rule in rules for spec in (rule.per_user, rule.total) if spec is not None)
+        self._db = DBRateLimiter(idle_after=timedelta(seconds=longest))
+
+    async def __call__(self, handler, event, data):
+        rule = self._match(event)
+        if rule is None:
+            return await handler(event, data)
+
+        limits = [(f'{rule.name}:user:{event.from_user.id}', rule.per_user)]
+        if rule.total is not None:
+            limits.append((f'{rule.name}:total', rule.total))
+        try:
+            if self.persist:
+                wait = await sync_to_async(self._db.hit)(limits)
+            else:
+                wait = self._memory.hit(limits)
+        except Exception:
+            # недоступность БД не должна блокировать бота
+            logger.exception('Не удалось проверить лимит %s, пропускаем запрос', rule.name)
+            wait = 0
+
+        if not wait:
+            return await handler(event, data)
+
+        self.limited += 1
+        logger.info('Пользователь %s превысил лимит %s', event.from_user.id, rule.name)
+        text = f'⏳ Слишком много запросов. Повторите через {math.ceil(wait)} с.'
+        if isinstance(event, types.CallbackQuery):
+            await event.answer(text, show_alert=True)
+        else:
+            await event.answer(text)
+        return None
+
+    def _match(self, event) -> RateLimitRule | None:
+        if isinstance(event, types.CallbackQuery):
+            key = event.data or ''
+        elif isinstance(event, types.Message) and event.text:
+            # /getconfig@bot_name arg -> /getconfig
+            key = event.text.split(maxsplit=1)[0].split('@')[0]
+        else:
+            return None
+        return next((rule for rule in self.rules if rule.matches(key)), None)
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+
+from config.env_constants import USER_CACHE_MAX_SIZE, USER_CACHE_NEGATIVE_TTL, USER_CACHE_TTL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from vpn.models.users import VPNUser
+
+
+class UserStatus(Enum):
+    UNKNOWN = 'unknown'  # не зарегистрирован
+    INACTIVE = 'inactive'  # деактивирован администратором
+
+
+# все поля модели: экземпляр для обработчика собирается целиком, без отложенных полей и скрытых запросов
+USER_FIELDS = tuple(field.attname for field in VPNUser._meta.concrete_fields)  # noqa: SLF001
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Снимок полей активного пользователя. Сама модель в кэше не хранится.
+
+    Поля могут отставать от БД не больше чем на TTL. Лимит конфигов проверяет воркер выдачи
+    по свежей строке пользователя, поэтому обработчикам снимка достаточно.
+    """
+
+    values: tuple
+
+    @classmethod
+    def from_user(cls, user: VPNUser) -> 'CachedUser':
+        return cls(tuple(getattr(user, name) for name in USER_FIELDS))
+
+    def instance(self) -> VPNUser:
+        """Новый экземпляр VPNUser для одного апдейта: изменения одного обработчика не видны другим."""
+        return VPNUser.from_db('default', USER_FIELDS, self.values)
+
+
+@dataclass
+class UserCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return (
+            f'попаданий {self.hits}, промахов {self.misses} ({self.hit_rate:.0%}), '
+            f'вытеснено {self.evictions}, сброшено {self.invalidations}'
+        )
+
+
+class UserCache:
+    """LRU-кэш пользователей бота по telegram_id с ограниченным временем жизни записей.
+
+    Кэшируются и отрицательные ответы (незарегистрированные и деактивированные пользователи) —
+    с более коротким TTL. Запись сбрасывается при сохранении или удалении VPNUser в этом процессе
+    (в том числе при одобрении доступа администратором); изменения из других процессов, например
+    из Django admin, видны не позже чем через TTL.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.stats = UserCacheStats()
+        # сброс приходит из потоков sync_to_async, поэтому нужна блокировка
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, CachedUser | UserStatus]] = OrderedDict()
+
+    def get(self, telegram_id: int) -> CachedUser | UserStatus | None:
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(telegram_id, None)
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.stats.hits += 1
+            return entry[1]
+
+    def set(self, telegram_id: int, value: CachedUser | UserStatus):
+        ttl = self.ttl if isinstance(value, CachedUser) else self.negative_ttl
+        with self._lock:
+            self._entries[telegram_id] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, telegram_id: int):
+        with self._lock:
+            if self._entries.pop(telegram_id, None) is not None:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL, USER_CACHE_MAX_SIZE)
+
+
+def resolve_user(telegram_id: int) -> CachedUser | UserStatus:
+    """Определить пользователя одним запросом: активный, деактивированный или неизвестный."""
+    user = VPNUser.objects.filter(telegram_id=telegram_id).first()
+    if user is None:
+        return UserStatus.UNKNOWN
+    return CachedUser.from_user(user) if user.is_active else UserStatus.INACTIVE
+
+
+@receiver(post_save, sender=VPNUser)
+@receiver(post_delete, sender=VPNUser)
+def invalidate_cached_user(sender, instance: VPNUser, **kwargs):
+    user_cache.invalidate(instance.telegram_id)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from config.env_constants import UPDATE_MAX_CONCURRENCY, UPDATE_USER_QUEUE_LIMIT
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SchedulerStats:
+    processed: int = 0
+    deduplicated: int = 0
+    rejected: int = 0
+
+
+@dataclass
+class _UserSlot:
+    # asyncio.Lock пропускает ожидающих по очереди, поэтому апдейты пользователя обрабатываются по порядку
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    pending: int = 0
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """Outer-middleware для апдейтов: один пользователь — строго по очереди, разные — параллельно.
+
+    Одновременно обрабатывается не больше `max_concurrency` апдейтов, у пользователя в очереди может
+    ждать не больше `per_user_limit` апдейтов (лишние отклоняются с ответом). Повтор команды или
+    callback'а, который ещё выполняется, не запускает обработчик заново, а ждёт результат первого.
+
+    Состояние хранится в памяти процесса, поэтому гарантии действуют только при одном процессе бота:
+    с этим middleware webhook всегда запускается одним воркером (см. UPDATE_SERIALIZE).
+    """
+
+    def __init__(self, max_concurrency: int = UPDATE_MAX_CONCURRENCY, per_user_limit: int = UPDATE_USER_QUEUE_LIMIT):
+        self.per_user_limit = per_user_limit
+        self.stats = SchedulerStats()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._users: dict[int, _UserSlot] = {}
+        self._in_flight: dict[tuple[int, str], asyncio.Future] = {}
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        key = self._dedupe_key(event)
+        if key is not None:
+            in_flight = self._in_flight.get((user.id, key))
+            if in_flight is not None:
+                self.stats.deduplicated += 1
+                logger.info('Пользователь %s повторил %r, ждём результат первого запроса', user.id, key)
+                if event.callback_query:
+                    # на повторное нажатие отвечает только этот апдейт, иначе кнопка «крутится» до таймаута
+                    await event.callback_query.answer()
+                return await asyncio.shield(in_flight)
+
+        slot = self._users.setdefault(user.id, _UserSlot())
+        if slot.pending >= self.per_user_limit:
+            self.stats.rejected += 1
+            await self._reject(event)
+            return None
+
+        future = None
+        if key is not None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[user.id, key] = future
+        slot.pending += 1
+        try:
+            return await self._run(handler, event, data, slot, future)
+        finally:
+            slot.pending -= 1
+            if not slot.pending:
+                self._users.pop(user.id, None)
+            if key is not None:
+                self._in_flight.pop((user.id, key), None)
+
+    async def _run(self, handler, event: Update, data, slot: _UserSlot, future: asyncio.Future | None):
+        try:
+            async with slot.lock, self._semaphore:
+                result = await handler(event, data)
+        except asyncio.CancelledError:
+            if future is not None:
+                future.cancel()
+            raise
+        except BaseException as e:
+            if future is not None:
+                future.set_exception(e)
+                future.exception()  # ошибку получит сам обработчик, повторы её тоже увидят
+            raise
+        if future is not None:
+            future.set_result(result)
+        self.stats.processed += 1
+        return result
+
+    @staticmethod
+    def _dedupe_key(event: Update) -> str | None:
+        if event.message and event.message.text and event.message.text.startswith('/'):
+            return event.message.text.strip()
+        if event.callback_query and event.callback_query.data:
+            return f'cb:{event.callback_query.data}'
+        return None
+
+    @staticmethod
+    async def _reject(event: Update):
+        text = '⏳ Слишком много запросов подряд, дождитесь ответа на предыдущие.'
+        if event.message:
+            await event.message.answer(text)
+        elif event.callback_query:
+            await event.callback_query.answer(text, show_alert=True)
@@ -1,10 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin.utils import quote
 from django.urls import reverse
 from django.utils.html import format_html
 
-from .models.configs import AmneziaWGConfig, VLESSConfig, VPNUser
+from .models.configs import (
+    AmneziaWGConfig,
+    SpareVLESSClient,
+    VLESSConfig,
+    VPNUser,
+    set_configs_active,
+)
+from .models.jobs import ProvisioningJob
+from .models.limits import RateLimitBucket
 from .models.servers import ServerProtocol, VPNServer
+from .models.stats import TrafficStat
 
 
 class BaseConfigInline(admin.TabularInline):
@@ -32,6 +41,35 @@ class AmneziaWGConfigInline(BaseConfigInline):
     model = AmneziaWGConfig
 
 
+def _report_bulk_result(modeladmin: admin.ModelAdmin, request, updated: int, failed: list[VPNServer]):
+    modeladmin.message_user(request, f'Изменено конфигов: {updated}')
+    if failed:
+        names = ', '.join(server.name for server in failed)
+        modeladmin.message_user(request, f'Не удалось применить изменения на серверах: {names}', messages.ERROR)
+
+
+def _report_sync_failures(modeladmin: admin.ModelAdmin, request, failed: list[VPNServer]):
+    if failed:
+        names = ', '.join(server.name for server in failed)
+        modeladmin.message_user(
+            request,
+            f'Не удалось отключить конфиги на серверах: {names}. Отключите их повторно в списке конфигов',
+            messages.ERROR,
+        )
+
+
+class BaseConfigAdmin(admin.ModelAdmin):
+    actions = ('activate_configs', 'deactivate_configs')
+
+    @admin.action(description='Активировать выбранные конфиги')
+    def activate_configs(self, request, queryset):
+        _report_bulk_result(self, request, *set_configs_active(queryset.select_related('server'), is_active=True))
+
+    @admin.action(description='Деактивировать выбранные конфиги')
+    def deactivate_configs(self, request, queryset):
+        _report_bulk_result(self, request, *set_configs_active(queryset.select_related('server'), is_active=False))
+
+
 class ServerProtocolInline(admin.StackedInline):
     model = ServerProtocol
     extra = 0
@@ -52,6 +90,32 @@ class VPNUserAdmin(admin.ModelAdmin):
     search_fields = ('telegram_id', 'username')
     list_filter = ('is_active',)
     inlines = (VLESSConfigInline, AmneziaWGConfigInline)
+    actions = ('activate_users', 'deactivate_users')
+
+    # save(), а не queryset.update(): так отключаются конфиги и срабатывает post_save (сброс кэша пользователей бота)
+    @admin.action(description='Активировать выбранных пользователей')
+    def activate_users(self, request, queryset):
+        # как и VPNUser.save, включение пользователя не включает обратно его конфиги
+        users = list(queryset.filter(is_active=False))
+        for user in users:
+            user.is_active = True
+            user.save()
+        self.message_user(request, f'Активировано пользователей: {len(users)}')
+
+    @admin.action(description='Деактивировать выбранных пользователей и их конфиги')
+    def deactivate_users(self, request, queryset):
+        users = list(queryset.filter(is_active=True))
+        failed: dict[int, VPNServer] = {}
+        for user in users:
+            user.is_active = False
+            user.save()
+            failed.update((server.pk, server) for server in user.config_sync_failures)
+        self.message_user(request, f'Деактивировано пользователей: {len(users)}')
+        _report_sync_failures(self, request, list(failed.values()))
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        _report_sync_failures(self, request, obj.config_sync_failures)
 
     @admin.display(description='Username')
     def formatted_username(self, obj):
@@ -65,7 +129,7 @@ class VPNUserAdmin(admin.ModelAdmin):
 
 
 @admin.register(VLESSConfig)
-class VLESSConfigAdmin(admin.ModelAdmin):
+class VLESSConfigAdmin(BaseConfigAdmin):
     list_display = ('client_id', 'user', 'expires_at', 'is_active', 'server')
     change_form_fields = ('client_id', 'user', 'config_email', 'expires_at', 'is_active', 'server')
     readonly_fields = ('user', 'client_id', 'server')
@@ -83,7 +147,7 @@ class VLESSConfigAdmin(admin.ModelAdmin):
 
 
 @admin.register(AmneziaWGConfig)
-class AmneziaWGConfigAdmin(admin.ModelAdmin):
+class AmneziaWGConfigAdmin(BaseConfigAdmin):
     list_display = ('short_client_id', 'user', 'expires_at', 'allowed_ip', 'is_active', 'server')
     readonly_fields = ('user', 'private_key', 'client_id', 'allowed_ip', 'server')
     list_filter = ('is_active', 'expires_at')
@@ -111,15 +175,80 @@ class VPNServerAdmin(admin.ModelAdmin):
         'list_protocols',
         'max_configs',
         'issued_configs',
+        'spare_clients',
+        'available_slots',
+        'is_overloaded',
         'location',
         'is_active',
     )
     inlines = (ServerProtocolInline,)
 
+    def get_queryset(self, request):
+        # счётчики конфигов считаются одним запросом вместо нескольких COUNT на каждую строку
+        return super().get_queryset(request).with_load().prefetch_related('protocols')
+
     @admin.display(description='Protocols')
     def list_protocols(self, obj):
         return ', '.join(p.protocol for p in obj.protocols.all())
 
+    @admin.display(description='Issued configs', ordering='issued_count')
+    def issued_configs(self, obj):
+        return obj.issued_configs
+
+    @admin.display(description='Spare clients', ordering='spare_count')
+    def spare_clients(self, obj):
+        return obj.spare_clients
+
+    @admin.display(description='Available slots', ordering='free_slots')
+    def available_slots(self, obj):
+        return obj.available_slots
+
+    @admin.display(description='Overloaded', boolean=True)
+    def is_overloaded(self, obj):
+        return obj.is_overloaded
+
+
+@admin.register(TrafficStat)
+class TrafficStatAdmin(admin.ModelAdmin):
+    list_display = ('config', 'period', 'bucket', 'uplink', 'downlink')
+    list_filter = ('period', 'bucket')
+    search_fields = ('config__user__username', 'config__user__telegram_id', 'config__config_email')
+    list_select_related = ('config__user',)
+    readonly_fields = ('config', 'period', 'bucket', 'uplink', 'downlink')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(SpareVLESSClient)
+class SpareVLESSClientAdmin(admin.ModelAdmin):
+    list_display = ('config_email', 'server', 'client_id', 'created_at')
+    list_filter = ('server',)
+    list_select_related = ('server',)
+    readonly_fields = ('server', 'client_id', 'config_email', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProvisioningJob)
+class ProvisioningJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'status', 'attempts', 'run_after', 'created_at', 'config_id')
+    list_filter = ('status', 'kind')
+    search_fields = ('user__username', 'user__telegram_id', 'idempotency_key')
+    list_select_related = ('user',)
+    readonly_fields = ('idempotency_key', 'config_id', 'last_error', 'locked_at', 'created_at', 'updated_at')
+
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ('key', 'tokens', 'updated_at')
+    search_fields = ('key',)
+    readonly_fields = ('key', 'tokens', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
 
 # == Настройки админки ==
 admin.site.site_header = 'VPN Manager Admin'
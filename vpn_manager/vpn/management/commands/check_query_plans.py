@@ -0,0 +1,153 @@
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from vpn.models.configs import AmneziaWGConfig, VLESSConfig
+from vpn.models.servers import VPNServer
+from vpn.models.users import VPNUser
+
+
+# признаки полного просмотра таблицы в EXPLAIN для SQLite и PostgreSQL
+FULL_SCAN_MARKERS = ('SCAN vpn_', 'Seq Scan on')
+
+
+@dataclass
+class Fixtures:
+    user: VPNUser
+    server: VPNServer
+    config: VLESSConfig
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    queryset: Callable[[Fixtures], QuerySet]
+    index: str | None = None  # None — достаточно, чтобы не было полного просмотра
+
+
+@dataclass
+class QueryCountCheck:
+    name: str
+    run: Callable[[Fixtures], object]
+    queries: int
+
+
+PLAN_CHECKS = (
+    PlanCheck(
+        'авторизация пользователя',
+        lambda f: VPNUser.objects.filter(telegram_id=f.user.telegram_id, is_active=True),
+    ),
+    PlanCheck('конфиг пользователя по id', lambda f: VLESSConfig.objects.filter(pk=f.config.pk, user=f.user)),
+    *(
+        check
+        for model in (VLESSConfig, AmneziaWGConfig)
+        for check in (
+            PlanCheck(
+                f'{model.__name__}: активные конфиги сервера',
+                lambda f, model=model: model.objects.filter(server=f.server, is_active=True),
+                f'{model._meta.model_name}_srv_act_idx',  # noqa: SLF001
+            ),
+            PlanCheck(
+                f'{model.__name__}: конфиги пользователя',
+                lambda f, model=model: model.objects.filter(user=f.user, is_active=True),
+                f'{model._meta.model_name}_user_act_idx',  # noqa: SLF001
+            ),
+            PlanCheck(
+                f'{model.__name__}: истёкшие активные конфиги',
+                lambda _, model=model: model.objects.filter(is_active=True, expires_at__lte=timezone.now()),
+                f'{model._meta.model_name}_expires_idx',  # noqa: SLF001
+            ),
+        )
+    ),
+)
+
+QUERY_COUNT_CHECKS = (
+    QueryCountCheck(
+        'авторизация пользователя',
+        lambda f: VPNUser.objects.filter(telegram_id=f.user.telegram_id).first(),
+        1,
+    ),
+    QueryCountCheck(
+        'конфиг для callback с сервером и пользователем',
+        lambda f: VLESSConfig.objects.select_related('server', 'user').get(pk=f.config.pk, user=f.user).server.name,
+        1,
+    ),
+    QueryCountCheck('выбор наименее загруженного сервера', lambda _: VPNServer.get_least_loaded(), 1),
+    QueryCountCheck('загрузка сервера', lambda f: VPNServer.objects.with_load().get(pk=f.server.pk).available_slots, 1),
+    QueryCountCheck('число конфигов пользователя', lambda f: f.user.all_configs_count, 2),
+    QueryCountCheck('список /configs с серверами', lambda f: f.user.config_summaries(), 1),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет число запросов и планы EXPLAIN для горячих запросов бота. '
+        'Тестовые данные создаются в транзакции и откатываются; при регрессии команда завершается с ошибкой'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--show-plans', action='store_true', help='Вывести планы запросов')
+
+    def handle(self, *args, **options):
+        errors: list[str] = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # на почти пустых таблицах планировщик предпочтёт Seq Scan, а нам важно, что индекс применим
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            fixtures = self._create_fixtures()
+            for check in PLAN_CHECKS:
+                errors.extend(self._check_plan(check, fixtures, show=options['show_plans']))
+            for check in QUERY_COUNT_CHECKS:
+                errors.extend(self._check_query_count(check, fixtures))
+            transaction.set_rollback(True)
+
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS(f'Проверено {len(PLAN_CHECKS)} планов и {len(QUERY_COUNT_CHECKS)} путей'))
+
+    @staticmethod
+    def _create_fixtures() -> Fixtures:
+        # bulk_create не вызывает save(), поэтому к серверам никто не подключается
+        suffix = uuid.uuid4().hex[:8]
+        user = VPNUser.objects.create(telegram_id=-int(suffix, 16), full_name=f'query-plan-{suffix}')
+        server = VPNServer.objects.create(name=f'query-plan-{suffix}', host='192.0.2.1')
+        (config,) = VLESSConfig.objects.bulk_create(
+            [
+                VLESSConfig(
+                    user=user,
+                    server=server,
+                    client_id=uuid.uuid4(),
+                    config_email=f'query-plan-{suffix}',
+                    expires_at=timezone.now() - timedelta(days=1),
+                ),
+            ],
+        )
+        return Fixtures(user, server, config)
+
+    def _check_plan(self, check: PlanCheck, fixtures: Fixtures, *, show: bool) -> list[str]:
+        plan = check.queryset(fixtures).explain()
+        if show:
+            self.stdout.write(f'{check.name}:\n{plan}\n')
+        errors = []
+        if any(marker in plan for marker in FULL_SCAN_MARKERS):
+            errors.append(f'{check.name}: полный просмотр таблицы\n{plan}')
+        if check.index and check.index not in plan:
+            errors.append(f'{check.name}: не используется индекс {check.index}\n{plan}')
+        return errors
+
+    @staticmethod
+    def _check_query_count(check: QueryCountCheck, fixtures: Fixtures) -> list[str]:
+        with CaptureQueriesContext(connection) as ctx:
+            check.run(fixtures)
+        if len(ctx.captured_queries) != check.queries:
+            sql = '\n'.join(query['sql'] for query in ctx.captured_queries)
+            return [f'{check.name}: {len(ctx.captured_queries)} запросов вместо {check.queries}\n{sql}']
+        return []
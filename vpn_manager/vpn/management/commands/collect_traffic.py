@@ -0,0 +1,34 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from vpn.utils.traffic_utils import collect_traffic, prune_hourly_traffic
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Периодически собирает статистику трафика пользователей со всех VLESS-серверов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60, help='Интервал сбора, секунд')
+        parser.add_argument('--hourly-retention-days', type=int, default=7, help='Сколько дней хранить часовые данные')
+        parser.add_argument('--once', action='store_true', help='Выполнить один проход и выйти')
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options['interval'], timedelta(days=options['hourly_retention_days']), options['once']))
+
+    async def _run(self, interval: float, retention: timedelta, once: bool):  # noqa: FBT001
+        while True:
+            try:
+                await collect_traffic()
+                await sync_to_async(prune_hourly_traffic)(retention)
+            except Exception:
+                logger.exception('Ошибка при сборе статистики трафика')
+            if once:
+                return
+            await asyncio.sleep(interval)
@@ -0,0 +1,45 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from vpn.utils.spare_pool_utils import fill_spare_clients, get_spare_usage
+from vpn.utils.vless_utils import spare_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Поддерживает на каждом VLESS-сервере запас заранее добавленных в Xray клиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=60, help='Интервал проверки пула, секунд')
+        parser.add_argument('--demand-window-hours', type=float, default=24, help='За какой период считать спрос')
+        parser.add_argument('--cover-hours', type=float, default=6, help='На сколько часов спроса держать запас')
+        parser.add_argument('--min-size', type=int, default=2, help='Минимальный верхний порог пула')
+        parser.add_argument('--max-size', type=int, default=50, help='Максимальный верхний порог пула')
+        parser.add_argument('--low-ratio', type=float, default=0.5, help='Нижний порог как доля верхнего')
+        parser.add_argument('--once', action='store_true', help='Выполнить один проход и выйти')
+
+    def handle(self, *args, **options):
+        plan_options = {
+            'demand_window': timedelta(hours=options['demand_window_hours']),
+            'cover': timedelta(hours=options['cover_hours']),
+            'min_size': options['min_size'],
+            'max_size': options['max_size'],
+            'low_ratio': options['low_ratio'],
+        }
+        while True:
+            try:
+                for plan in fill_spare_clients(**plan_options):
+                    self.stdout.write(str(plan))
+                usage = get_spare_usage(timezone.now() - plan_options['demand_window'])
+                self.stdout.write(f'Пул: {usage}, {spare_stats}')
+            except Exception:
+                logger.exception('Ошибка при пополнении пула резервных клиентов')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
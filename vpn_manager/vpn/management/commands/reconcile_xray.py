@@ -0,0 +1,32 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from vpn.utils.reconcile_utils import reconcile_all
+
+
+class Command(BaseCommand):
+    help = 'Сверяет пользователей Xray (GetInboundUsers) с активными VLESS-конфигами в БД и устраняет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+        parser.add_argument(
+            '--remove-unknown',
+            action='store_true',
+            help='Удалить из Xray и его конфига пользователей, для которых нет активного конфига в БД '
+            '(кроме созданных за последние RECONCILE_GRACE_PERIOD секунд)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        reports = asyncio.run(reconcile_all(dry_run=options['dry_run'], remove_unknown=options['remove_unknown']))
+        for report in reports:
+            self.stdout.write(str(report))
+        self.stdout.write(
+            f'Серверов: {len(reports)}, '
+            f'нет в Xray: {sum(r.missing for r in reports)}, '
+            f'лишних в Xray: {sum(r.unknown for r in reports)}, '
+            f'ошибок: {sum(1 for r in reports if r.error)}, '
+            f'всего {(time.perf_counter() - started) * 1000:.1f} мс',
+        )
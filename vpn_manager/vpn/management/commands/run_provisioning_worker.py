@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from aiogram import Bot
+from asgiref.sync import sync_to_async
+from config.env_constants import TELEGRAM_BOT_TOKEN
+from django.core.management.base import BaseCommand
+
+from vpn.models.jobs import ProvisioningJob
+from vpn.utils.provisioning_utils import (
+    PermanentJobError,
+    notify_done,
+    notify_failed,
+    run_job,
+    send_reminder,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задачи выдачи конфигов из очереди в БД. Можно запускать несколько экземпляров параллельно'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Сколько задач выполнять одновременно')
+        parser.add_argument('--poll-interval', type=float, default=1, help='Пауза при пустой очереди, секунд')
+        parser.add_argument('--backoff', type=float, default=10, help='Задержка перед первым повтором, секунд')
+        parser.add_argument(
+            '--stale-after',
+            type=float,
+            default=600,
+            help='Через сколько секунд задача упавшего воркера снова берётся в работу',
+        )
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options))
+
+    async def _run(self, options: dict):
+        bot = Bot(token=TELEGRAM_BOT_TOKEN)
+        try:
+            await asyncio.gather(*(self._worker(bot, options) for _ in range(options['concurrency'])))
+        finally:
+            await bot.session.close()
+
+    async def _worker(self, bot: Bot, options: dict):
+        stale_after = timedelta(seconds=options['stale_after'])
+        backoff = timedelta(seconds=options['backoff'])
+        while True:
+            try:
+                jobs = await sync_to_async(ProvisioningJob.claim)(1, stale_after)
+            except Exception:
+                logger.exception('Не удалось получить задачи из очереди')
+                jobs = []
+            if not jobs:
+                if options['once']:
+                    return
+                await asyncio.sleep(options['poll_interval'])
+                continue
+            await self._process(bot, jobs[0], backoff)
+
+    async def _process(self, bot: Bot, job: ProvisioningJob, backoff: timedelta):
+        if job.kind == ProvisioningJob.EXPIRY_REMINDER:
+            await self._remind(bot, job, backoff)
+            return
+        try:
+            # отдельный поток на задачу, чтобы медленный сервер не задерживал остальных
+            config = await sync_to_async(run_job, thread_sensitive=False)(job)
+        except PermanentJobError as e:
+            await sync_to_async(job.mark_failed)(str(e), retry=False, backoff=backoff)
+            await self._notify(notify_failed(bot, job, str(e)), job)
+            return
+        except Exception as e:
+            logger.exception('Ошибка выполнения задачи %s (попытка %s)', job.pk, job.attempts)
+            retry_at = await sync_to_async(job.mark_failed)(repr(e), retry=True, backoff=backoff)
+            if retry_at is None:
+                text = '❌ Не удалось создать конфиг. Попробуйте позже.'
+                await self._notify(notify_failed(bot, job, text), job)
+            return
+
+        await sync_to_async(job.mark_done)(config.pk)
+        await self._notify(notify_done(bot, job, config), job)
+        logger.info('Задача %s выполнена: %s', job.pk, config)
+
+    @staticmethod
+    async def _remind(bot: Bot, job: ProvisioningJob, backoff: timedelta):
+        try:
+            await send_reminder(bot, job)
+        except Exception as e:
+            logger.warning('Не удалось отправить напоминание %s в чат %s: %s', job.pk, job.chat_id, e)
+            await sync_to_async(job.mark_failed)(repr(e), retry=True, backoff=backoff)
+            return
+        await sync_to_async(job.mark_done)(job.config_id)
+
+    @staticmethod
+    async def _notify(coro, job: ProvisioningJob):
+        # конфиг уже сохранён, поэтому ошибка Telegram не должна приводить к повтору задачи
+        try:
+            await coro
+        except Exception:
+            logger.exception('Не удалось отправить результат задачи %s в чат %s', job.pk, job.chat_id)
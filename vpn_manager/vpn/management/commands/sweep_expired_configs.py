@@ -0,0 +1,42 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from vpn.utils.expiry_utils import CONFIG_MODELS, queue_expiry_reminders, sweep_expired
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Отключает истёкшие конфиги и ставит в очередь напоминания о скором истечении'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=600, help='Интервал проверки, секунд')
+        parser.add_argument('--remind-days', type=float, default=3, help='За сколько дней напоминать об истечении')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько конфигов обрабатывать за раз')
+        parser.add_argument('--once', action='store_true', help='Выполнить один проход и выйти')
+
+    def handle(self, *args, **options):
+        remind_before = timedelta(days=options['remind_days'])
+        while True:
+            try:
+                self._sweep(remind_before, options['chunk_size'])
+            except Exception:
+                logger.exception('Ошибка при обработке истёкших конфигов')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
+
+    def _sweep(self, remind_before: timedelta, chunk_size: int):
+        started = time.perf_counter()
+        for model in CONFIG_MODELS:
+            deactivated, failed = sweep_expired(model, chunk_size=chunk_size)
+            reminders = queue_expiry_reminders(model, remind_before, chunk_size=chunk_size)
+            self.stdout.write(f'{model.__name__}: отключено {deactivated}, напоминаний {reminders}')
+            if failed:
+                names = ', '.join(sorted(server.name for server in failed))
+                self.stderr.write(f'{model.__name__}: не удалось отключить конфиги на серверах {names}')
+        self.stdout.write(f'Проверка заняла {(time.perf_counter() - started) * 1000:.1f} мс')
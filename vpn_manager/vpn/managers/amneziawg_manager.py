@@ -1,33 +1,114 @@
-import json
+import io
+import shlex
 
 from django.utils import timezone
 from wgconfig import WGConfig  # type: ignore[import-untyped]
 from wireguard_tools import WireguardKey
 
 from vpn.managers.base_config_manager import BaseConfigManager
-from vpn.models.servers import ServerProtocol, VPNServer
-from vpn.utils.ssh_utils import SSHClient
+from vpn.models.servers import ServerProtocol, VPNServer, WGAddressPool
+from vpn.utils.ssh_utils import SSHClient, execute_container_script
 
 
 class WGManager(BaseConfigManager):
-    def __init__(self, server: VPNServer, ssh: SSHClient | None = None, *, should_restart: bool = True):
-        self.server_protocol = server.protocols.get(protocol=ServerProtocol.AMNEZIAWG)
+    protocol = ServerProtocol.AMNEZIAWG
+    wg_tool: str = 'awg'
+    # параметры обфускации AmneziaWG из секции [Interface], которые нужны клиенту
+    interface_param_keys: tuple[str, ...] = ('Jc', 'Jmin', 'Jmax', 'S1', 'S2', 'H1', 'H2', 'H3', 'H4')
+
+    # Пиры применяются к работающему интерфейсу через `awg set`, поэтому контейнер
+    # по умолчанию не перезапускается (перезапуск нужен только для изменений секции [Interface])
+    def __init__(self, server: VPNServer, ssh: SSHClient | None = None, *, should_restart: bool = False):
+        self.server_protocol = server.protocols.get(protocol=self.protocol)
+        self.cfg = WGConfig()
+        # адреса, выделенные и освобождённые в этой сессии: фиксируются в пуле только после записи конфига
+        self._allocated_ips: list[str] = []
+        self._released_ips: list[str] = []
+        # команды `awg set` для применения изменений пиров без перезапуска контейнера
+        self._live_ops: list[str] = []
         super().__init__(server, ssh, should_restart=should_restart)
-        self.cfg = WGConfig(self.local_conf)
-        self.cfg.read_file()
+
+    def _parse_conf(self, data: bytes):
+        self.cfg.read_from_fileobj(io.StringIO(data.decode()))
+        self._cache_interface_params()
+
+    def _cache_interface_params(self):
+        """Сохранить параметры интерфейса в ServerProtocol, чтобы выдавать конфиги без SSH."""
+        interface = self.cfg.get_interface()
+        params = {k: interface.get(k, '') for k in self.interface_param_keys}
+        if params != self.server_protocol.wg_interface_params:
+            self.server_protocol.wg_interface_params = params
+            ServerProtocol.objects.filter(pk=self.server_protocol.pk).update(wg_interface_params=params)
+
+    def _dump_conf(self) -> bytes:
+        buf = io.StringIO()
+        self.cfg.write_to_fileobj(buf)
+        return buf.getvalue().encode()
 
     def generate_wg_keys(self):
         priv = WireguardKey.generate()
         return str(priv), str(priv.public_key()), self.server_protocol.wg_preshared_key
 
+    @property
+    def interface_name(self) -> str:
+        return self.server_protocol.config_filename.removesuffix('.conf')
+
+    def commit(self):
+        # конфиг сохраняется первым, чтобы изменения пережили перезапуск контейнера
+        super().commit()
+        for ip in self._released_ips:
+            WGAddressPool.release(self.server_protocol, ip)
+        self._allocated_ips, self._released_ips = [], []
+        self._apply_live()
+
+    def rollback(self):
+        for ip in self._allocated_ips:
+            WGAddressPool.release(self.server_protocol, ip)
+        self._allocated_ips, self._released_ips, self._live_ops = [], [], []
+
+    def _session_state(self) -> tuple:
+        return super()._session_state(), len(self._allocated_ips), len(self._released_ips), len(self._live_ops)
+
+    def _restore_session_state(self, state: tuple):
+        base_state, allocated, released, live_ops = state
+        super()._restore_session_state(base_state)
+        # адреса, выделенные откатываемыми изменениями, сразу возвращаем в пул
+        for ip in self._allocated_ips[allocated:]:
+            WGAddressPool.release(self.server_protocol, ip)
+        del self._allocated_ips[allocated:], self._released_ips[released:], self._live_ops[live_ops:]
+
+    def _apply_live(self):
+        ops, self._live_ops = self._live_ops, []
+        if ops and not self.should_restart:
+            execute_container_script(self.ssh, self.server_protocol.container_name, '\n'.join(['set -e', *ops]))
+
+    def _queue_set_peer(self, public_key: str, preshared_key: str, allowed_ips: list[str]):
+        command = (
+            f'{self.wg_tool} set {shlex.quote(self.interface_name)} peer {shlex.quote(public_key)} '
+            f'allowed-ips {shlex.quote(",".join(allowed_ips))}'
+        )
+        if preshared_key:
+            command = f'printf %s {shlex.quote(preshared_key)} | {command} preshared-key /dev/stdin'
+        self._live_ops.append(command)
+
+    def _queue_remove_peer(self, public_key: str):
+        self._live_ops.append(
+            f'{self.wg_tool} set {shlex.quote(self.interface_name)} peer {shlex.quote(public_key)} remove',
+        )
+
+    @staticmethod
+    def _peer_ips(peer: dict) -> list[str]:
+        allowed_ips = peer.get('AllowedIPs', [])
+        return [allowed_ips] if isinstance(allowed_ips, str) else list(allowed_ips)
+
     def get_next_ip(self):
-        used = (
-            [p.get('AllowedIPs', '') for p in self.cfg.peers.values() if p.get('AllowedIPs', '').startswith('10.8.1.')]
-            if self.cfg.peers
-            else []
+        ip = WGAddressPool.allocate(
+            self.server_protocol,
+            lambda: [addr for peer in self.cfg.peers.values() for addr in self._peer_ips(peer)],
+            peer_count=len(self.cfg.peers),
         )
-        last = max(int(ip.split('/')[0].split('.')[-1]) for ip in used) + 1
-        return f'10.8.1.{last}/32'
+        self._allocated_ips.append(ip)
+        return ip
 
     def add_peer(self, public_key, preshared_key, allowed_ip, client_id, client_name):
         if self.server_protocol.is_clients_table_supported:
@@ -50,59 +131,63 @@ class WGManager(BaseConfigManager):
         self.cfg.add_peer(public_key)
         self.cfg.add_attr(public_key, 'PresharedKey', preshared_key)
         self.cfg.add_attr(public_key, 'AllowedIPs', allowed_ip)
-        self.cfg.write_file()
-        self._save_conf()
+        self._mark_conf_dirty()
+        self._queue_set_peer(public_key, preshared_key, [allowed_ip])
 
     def remove_peer(self, public_key):
         if self.server_protocol.is_clients_table_supported:
             # Обновляем clientsTable
-            with open(self.local_table) as f:
-                table = json.load(f)
-            table = [c for c in table if c['clientId'] != public_key]
-            with open(self.local_table, 'w') as f:
-                json.dump(table, f, indent=4)
-            self._save_table()
+            self._set_table([c for c in self.table if c['clientId'] != public_key])
 
         # Обновляем основной файл конфигурации
+        peer = self.cfg.peers.get(public_key)
+        if peer is not None:
+            self._released_ips.extend(self._peer_ips(peer))
         self.cfg.del_peer(public_key)
-        self.cfg.write_file()
-        self._save_conf()
+        self._mark_conf_dirty()
+        self._queue_remove_peer(public_key)
 
     def enable_client(self, public_key, _):
         self.cfg.enable_peer(public_key)
-        self.cfg.write_file()
-        self._save_conf()
+        self._mark_conf_dirty()
+        peer = self.cfg.peers[public_key]
+        self._queue_set_peer(public_key, peer.get('PresharedKey', ''), self._peer_ips(peer))
 
     def disable_client(self, public_key):
         self.cfg.disable_peer(public_key)
-        self.cfg.write_file()
-        self._save_conf()
+        self._mark_conf_dirty()
+        self._queue_remove_peer(public_key)
+
+    def render_client_conf(self, private_key, preshared_key, allowed_ip) -> bytes:
+        """Сформировать клиентский .conf в памяти, без временного файла."""
+        return self.build_client_conf(self.server_protocol, private_key, preshared_key, allowed_ip)
 
-    def generate_client_conf_file(self, client_name, private_key, preshared_key, allowed_ip):
-        new_conf = WGConfig(f'/tmp/wg_{client_name}.conf')
-        server_cfg = self.cfg.get_interface()
+    @staticmethod
+    def build_client_conf(server_protocol: ServerProtocol, private_key, preshared_key, allowed_ip) -> bytes:
+        """Сформировать клиентский .conf только по данным из БД (параметры интерфейса берутся из кеша)."""
+        new_conf = WGConfig()
+        interface_params = server_protocol.wg_interface_params
 
         # 'None' означает добавление в секцию [Interface]
         new_conf.add_attr(None, 'Address', allowed_ip)
         new_conf.add_attr(None, 'DNS', '1.1.1.1, 1.0.0.1')
         new_conf.add_attr(None, 'PrivateKey', private_key)
-        for k in ('Jc', 'Jmin', 'Jmax', 'S1', 'S2', 'H1', 'H2', 'H3', 'H4'):
-            new_conf.add_attr(None, k, server_cfg.get(k, ''))
+        for k in WGManager.interface_param_keys:
+            new_conf.add_attr(None, k, interface_params.get(k, ''))
 
-        server_public_key = self.server_protocol.public_key
+        server_public_key = server_protocol.public_key
         new_conf.add_peer(server_public_key)
         new_conf.add_attr(server_public_key, 'PresharedKey', preshared_key)
         new_conf.add_attr(server_public_key, 'AllowedIPs', '0.0.0.0/0,::/0')
-        new_conf.add_attr(server_public_key, 'Endpoint', f'{self.server.host}:46446')
+        new_conf.add_attr(server_public_key, 'Endpoint', f'{server_protocol.server.host}:46446')
         new_conf.add_attr(server_public_key, 'PersistentKeepalive', '25')
 
-        new_conf.write_file()
-        return new_conf.filename
+        buf = io.StringIO()
+        new_conf.write_to_fileobj(buf)
+        return buf.getvalue().encode()
 
     def get_allowed_ip_from_client_id(self, client_id):
-        with open(self.local_table) as f:
-            table = json.load(f)
-        for entry in table:
+        for entry in self.table:
             if entry['clientId'] == client_id:
                 return entry['userData']['allowedIps']
         raise ValueError(f'Client with ID {client_id} does not exist.')
@@ -1,14 +1,20 @@
+import copy
+import io
 import json
 import logging
-import os
+from collections.abc import Iterator
+from contextlib import contextmanager
 
 from vpn.models.servers import ServerProtocol, VPNServer
+from vpn.utils.ssh_pool import CONNECTION_ERRORS, ssh_pool
 from vpn.utils.ssh_utils import (
     SSHClient,
     execute_ssh_command,
     get_file_from_container,
-    get_ssh_client,
     put_file_to_container,
+    read_file_from_container,
+    timed_transfer,
+    write_file_to_container,
 )
 
 
@@ -16,89 +22,146 @@ logger = logging.getLogger(__name__)
 
 
 class BaseConfigManager:
+    """Базовый менеджер конфигурации VPN-сервера.
+
+    Конфиг (и clientsTable, если поддерживается) загружается с сервера один раз в память,
+    все изменения применяются к загруженному документу, а на сервер он записывается
+    одним вызовом `commit()` при выходе из контекстного менеджера.
+    """
+
     clients_table_filename: str = 'clientsTable'
+    protocol: str
 
     def __init__(self, server: VPNServer, ssh: SSHClient | None = None, *, should_restart: bool = True):
         self.server = server
         self.server_protocol: ServerProtocol
-        self.ssh = ssh or get_ssh_client(self.server)
-        self.ssh.sftp_client = self.ssh.open_sftp()
-        self.local_conf = f'/tmp/{self.server_protocol.config_filename}'
-        self.local_table = f'/tmp/{self.clients_table_filename}.json'
-        self._load_files()
+        # без явно переданного клиента берём соединение из пула и возвращаем его в close()
+        self._pooled = ssh is None
+        if ssh is None:
+            self.ssh = ssh_pool.acquire(self.server)
+        else:
+            self.ssh = ssh
+            self.ssh.sftp_client = self.ssh.open_sftp()
         self.should_restart = should_restart
+        self.table: list[dict] = []
+        self._conf_dirty = False
+        self._table_dirty = False
+        # операции, изменения которых не удалось применить вживую после записи конфига: ключ операции -> ошибка
+        self.failed_mutations: dict[int | None, Exception] = {}
+        self._mutation: int | None = None
+        try:
+            self._load_files()
+        except BaseException as e:
+            self._release_ssh(broken=isinstance(e, CONNECTION_ERRORS))
+            raise
 
-    def _load_files(self):
-        if self.server_protocol.volumes_supported:
-            self.ssh.sftp_client.get(
-                self.server_protocol.config_path + self.server_protocol.config_filename,
-                self.local_conf,
-            )
-            if self.server_protocol.is_clients_table_supported:
-                self.ssh.sftp_client.get(
-                    self.server_protocol.config_path + self.clients_table_filename,
-                    self.local_table,
-                )
-        else:
-            get_file_from_container(
-                self.ssh,
-                self.server_protocol.container_name,
-                self.local_conf,
-                self.server_protocol.config_path + self.server_protocol.config_filename,
-            )
-            if self.server_protocol.is_clients_table_supported:
-                get_file_from_container(
-                    self.ssh,
-                    self.server_protocol.container_name,
-                    self.local_table,
-                    self.server_protocol.config_path + self.clients_table_filename,
-                )
-
-    def _save_conf(self):
-        if self.server_protocol.volumes_supported:
-            self.ssh.sftp_client.put(
-                self.local_conf,
-                self.server_protocol.config_path + self.server_protocol.config_filename,
-            )
-        else:
-            put_file_to_container(
-                self.ssh,
-                self.server_protocol.container_name,
-                self.local_conf,
-                self.server_protocol.config_path + self.server_protocol.config_filename,
-            )
-
-    def _save_table(self):
+    @property
+    def remote_conf_path(self) -> str:
+        return self.server_protocol.config_path + self.server_protocol.config_filename
+
+    @property
+    def remote_table_path(self) -> str:
+        return self.server_protocol.config_path + self.clients_table_filename
+
+    def _parse_conf(self, data: bytes):
+        """Разобрать загруженный конфиг в документ подкласса."""
+        raise NotImplementedError
+
+    def _dump_conf(self) -> bytes:
+        """Сериализовать документ подкласса для записи на сервер."""
+        raise NotImplementedError
+
+    @property
+    def transfer_mode(self) -> str:
         if self.server_protocol.volumes_supported:
-            self.ssh.sftp_client.put(
-                self.local_table,
-                self.server_protocol.config_path + self.clients_table_filename,
-            )
-        else:
-            put_file_to_container(
-                self.ssh,
-                self.server_protocol.container_name,
-                self.local_table,
-                self.server_protocol.config_path + self.clients_table_filename,
-            )
+            return 'sftp'
+        return self.server_protocol.container_transfer_mode
+
+    def _read_remote(self, path: str) -> bytes:
+        container = self.server_protocol.container_name
+        mode = self.transfer_mode
+        with timed_transfer(self.server, mode, 'read', path):
+            if mode == 'sftp':
+                buf = io.BytesIO()
+                self.ssh.sftp_client.getfo(path, buf)
+                return buf.getvalue()
+            if mode == ServerProtocol.TRANSFER_STREAM:
+                return read_file_from_container(self.ssh, container, path)
+            return get_file_from_container(self.ssh, container, path)
+
+    def _write_remote(self, path: str, data: bytes):
+        container = self.server_protocol.container_name
+        mode = self.transfer_mode
+        with timed_transfer(self.server, mode, 'write', path):
+            if mode == 'sftp':
+                self.ssh.sftp_client.putfo(io.BytesIO(data), path)
+            elif mode == ServerProtocol.TRANSFER_STREAM:
+                write_file_to_container(self.ssh, container, data, path)
+            else:
+                put_file_to_container(self.ssh, container, data, path)
+
+    def _load_files(self):
+        self._parse_conf(self._read_remote(self.remote_conf_path))
+        if self.server_protocol.is_clients_table_supported:
+            self.table = json.loads(self._read_remote(self.remote_table_path))
+
+    def _mark_conf_dirty(self):
+        self._conf_dirty = True
+
+    def _set_table(self, table: list[dict]):
+        self.table = table
+        self._table_dirty = True
 
     def _append_to_table(self, entry: dict):
-        with open(self.local_table) as f:
-            table = json.load(f)
-        table.append(entry)
-        with open(self.local_table, 'w') as f:
-            json.dump(table, f, indent=4)
-        self._save_table()
-
-    def close(self):
-        self.ssh.sftp_client.close()
-        self.ssh.close()
+        self.table.append(entry)
+        self._table_dirty = True
+
+    def commit(self):
+        """Записать изменённые документы на сервер (каждый не более одного раза)."""
+        if self._table_dirty:
+            self._write_remote(self.remote_table_path, json.dumps(self.table, indent=4).encode())
+            self._table_dirty = False
+        if self._conf_dirty:
+            self._write_remote(self.remote_conf_path, self._dump_conf())
+            self._conf_dirty = False
+
+    def rollback(self):
+        """Отменить побочные эффекты изменений, которые не будут записаны на сервер."""
+
+    def _session_state(self) -> tuple:
+        """Снимок несохранённых изменений сессии."""
+        return self._dump_conf(), copy.deepcopy(self.table), self._conf_dirty, self._table_dirty
+
+    def _restore_session_state(self, state: tuple):
+        conf, self.table, self._conf_dirty, self._table_dirty = state
+        self._parse_conf(conf)
+
+    @contextmanager
+    def savepoint(self, mutation: int | None = None) -> Iterator[None]:
+        """Если блок завершился ошибкой, вернуть сессию к состоянию до него; остальные изменения остаются.
+
+        Изменения блока помечаются ключом `mutation`: если их не удастся применить при `commit()`,
+        ошибка окажется в `failed_mutations[mutation]`.
+        """
+        state = self._session_state()
+        self._mutation = mutation
         try:
-            os.remove(self.local_conf)
-            if self.server_protocol.is_clients_table_supported:
-                os.remove(self.local_table)
-        except OSError:
-            logger.exception('Не удалось удалить временные файлы %s или %s', self.local_conf, self.local_table)
+            yield
+        except BaseException:
+            self._restore_session_state(state)
+            raise
+        finally:
+            self._mutation = None
+
+    def _release_ssh(self, *, broken: bool = False):
+        if self._pooled:
+            ssh_pool.release(self.server, self.ssh, broken=broken)
+        else:
+            # переданным соединением владеет вызывающий код: закрываем только открытый нами SFTP-канал
+            self.ssh.sftp_client.close()
+
+    def close(self, *, broken: bool = False):
+        self._release_ssh(broken=broken)
 
     def restart(self):
         execute_ssh_command(self.ssh, f'sudo docker restart {self.server_protocol.container_name}')
@@ -107,6 +170,13 @@ class BaseConfigManager:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.should_restart:
-            self.restart()
-        self.close()
+        try:
+            # при ошибке внутри блока ничего не записываем, поэтому и перезапуск не нужен
+            if exc_type is None:
+                self.commit()
+                if self.should_restart:
+                    self.restart()
+            else:
+                self.rollback()
+        finally:
+            self.close(broken=isinstance(exc_value, CONNECTION_ERRORS))
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any
+
+from config.env_constants import MUTATION_BATCH_MAX_SIZE, MUTATION_BATCH_WINDOW
+from django.db import close_old_connections, connections, transaction
+
+from vpn.managers.base_config_manager import BaseConfigManager
+from vpn.models.servers import ServerProtocol, VPNServer
+
+
+logger = logging.getLogger(__name__)
+
+type Mutation[T] = Callable[[Any], T]
+
+
+class MutationQueue:
+    """Последовательная очередь изменений конфигурации одного сервера.
+
+    Операции, пришедшие в течение `window` секунд, применяются пачкой в одной сессии менеджера:
+    конфиг загружается и записывается на сервер один раз, а gRPC/`awg set` изменения применяются
+    одним набором при `commit()`. Каждый вызывающий получает результат (или исключение) своей операции.
+    Внутри процесса пачки сервера идут по очереди, а между процессами (несколько воркеров бота, команды)
+    их упорядочивает блокировка строки протокола сервера, которая держится от загрузки конфига до записи.
+    """
+
+    def __init__(
+        self,
+        manager_cls: type[BaseConfigManager],
+        server: VPNServer,
+        *,
+        window: float = MUTATION_BATCH_WINDOW,
+        max_size: int = MUTATION_BATCH_MAX_SIZE,
+    ):
+        self.manager_cls = manager_cls
+        self.server = server
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending: list[tuple[Mutation, Future]] = []
+        self._worker: threading.Thread | None = None
+
+    def submit[T](self, op: Mutation[T]) -> T:
+        """Поставить операцию в очередь и дождаться её применения на сервере."""
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((op, future))
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run,
+                    name=f'mutations-{self.manager_cls.__name__}-{self.server.pk}',
+                    daemon=True,
+                )
+                self._worker.start()
+        return future.result()
+
+    def _run(self):
+        try:
+            while True:
+                # даём время накопиться операциям, пришедшим почти одновременно
+                time.sleep(self.window)
+                with self._lock:
+                    batch, self._pending = self._pending[: self.max_size], self._pending[self.max_size :]
+                    if not batch:
+                        self._worker = None
+                        return
+                self._apply(batch)
+        finally:
+            connections.close_all()
+
+    def _apply(self, batch: list[tuple[Mutation, Future]]):
+        close_old_connections()
+        started = time.perf_counter()
+        outcomes: list[tuple[bool, Any]] = []
+        try:
+            with transaction.atomic():
+                ServerProtocol.objects.select_for_update(no_key=True).get(
+                    server_id=self.server.pk,
+                    protocol=self.manager_cls.protocol,
+                )
+                # берём свежую запись сервера: очередь живёт дольше одного запроса
+                server = VPNServer.objects.get(pk=self.server.pk)
+                with self.manager_cls(server) as mgr:
+                    for i, (op, _) in enumerate(batch):
+                        try:
+                            # ошибка одной операции откатывает только её изменения, остальная пачка записывается
+                            with mgr.savepoint(i):
+                                outcomes.append((True, op(mgr)))
+                        except Exception as e:
+                            outcomes.append((False, e))
+            # операции, которые не удалось применить вживую, уже убраны из конфига
+            for i, e in mgr.failed_mutations.items():
+                outcomes[i] = (False, e)
+        except BaseException as e:
+            logger.exception('Не удалось применить пачку из %s изменений на сервере %s', len(batch), self.server)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), (ok, value) in zip(batch, outcomes, strict=True):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        logger.info(
+            'Пачка из %s изменений применена на сервере %s за %.1f мс',
+            len(batch),
+            self.server,
+            (time.perf_counter() - started) * 1000,
+        )
+
+
+_queues: dict[tuple[type[BaseConfigManager], int], MutationQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def submit_mutation[T](manager_cls: type[BaseConfigManager], server: VPNServer, op: Mutation[T]) -> T:
+    """Применить `op(manager)` к серверу через его очередь изменений и вернуть результат."""
+    key = (manager_cls, server.pk)
+    with _queues_lock:
+        queue = _queues.get(key)
+        if queue is None:
+            queue = _queues[key] = MutationQueue(manager_cls, server)
+    return queue.submit(op)
@@ -1,19 +1,153 @@
 import json
+import logging
 import uuid
+from dataclasses import dataclass, field
+from itertools import groupby
 
+from config.env_constants import XRAY_API_PORT, XRAY_INBOUND_TAG
 from django.utils import timezone
 
 from vpn.managers.base_config_manager import BaseConfigManager
 from vpn.models.servers import ServerProtocol, VPNServer
 from vpn.utils.ssh_utils import SSHClient
+from vpn.xray_api.exceptions import EmailExistsError, UserNotFoundError
 from vpn.xray_api.xray_add_user_grpc import XrayAPI
 
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ApiOp:
+    """Изменение пользователя Xray, которое применяется через gRPC после записи конфига."""
+
+    action: str  # 'add' или 'remove'
+    client: dict
+    mutation: int | None
+    # записи clientsTable, удалённые вместе с клиентом: возвращаются, если удаление не удалось
+    table_entries: list[dict] = field(default_factory=list)
+    # False, если клиента не было в конфиге и при откате удаления возвращать туда нечего
+    in_conf: bool = True
+
+
 class XRayManager(BaseConfigManager):
-    def __init__(self, server: VPNServer, ssh: SSHClient | None = None, *, should_restart: bool = True):
-        self.server_protocol = server.protocols.get(protocol=ServerProtocol.VLESS)
+    protocol = ServerProtocol.VLESS
+    inbound_tag: str = XRAY_INBOUND_TAG
+
+    # Все изменения пользователей применяются к Xray через gRPC, поэтому контейнер
+    # по умолчанию не перезапускается (перезапуск нужен только для изменения самих inbound'ов)
+    def __init__(self, server: VPNServer, ssh: SSHClient | None = None, *, should_restart: bool = False):
+        self.server_protocol = server.protocols.get(protocol=self.protocol)
+        self.config: dict = {}
+        self._pending_api_ops: list[ApiOp] = []
         super().__init__(server, ssh, should_restart=should_restart)
 
+    @staticmethod
+    def api_address_for(server: VPNServer) -> str:
+        return f'{server.host}:{XRAY_API_PORT}'
+
+    @property
+    def api_address(self) -> str:
+        return self.api_address_for(self.server)
+
+    def _parse_conf(self, data: bytes):
+        self.config = json.loads(data)
+
+    def _dump_conf(self) -> bytes:
+        return json.dumps(self.config, indent=4).encode()
+
+    @property
+    def clients(self) -> list[dict]:
+        return self.config['inbounds'][0]['settings']['clients']
+
+    def commit(self):
+        # сначала сохраняем конфиг, чтобы изменения пережили перезапуск Xray, затем применяем их вживую
+        super().commit()
+        failed = self._apply_api_ops()
+        if failed:
+            # возвращаем в конфиг состояние, которое реально работает в Xray
+            super().commit()
+        if None in self.failed_mutations:
+            raise self.failed_mutations[None]
+
+    def _session_state(self) -> tuple:
+        return super()._session_state(), len(self._pending_api_ops)
+
+    def _restore_session_state(self, state: tuple):
+        base_state, api_ops = state
+        super()._restore_session_state(base_state)
+        del self._pending_api_ops[api_ops:]
+
+    def _apply_api_ops(self) -> bool:
+        """Применить изменения через gRPC по одному; изменения операции, которая не применилась, откатываются.
+
+        Операция пачки применяется целиком или никак: уже применённые вживую изменения неудачной операции
+        отменяются, её правки убираются из конфига, а ошибка записывается в `failed_mutations`.
+        """
+        ops, self._pending_api_ops = self._pending_api_ops, []
+        failed = False
+        for mutation, group in groupby(ops, key=lambda api_op: api_op.mutation):
+            group_ops = list(group)
+            applied: list[ApiOp] = []
+            try:
+                for api_op in group_ops:
+                    self._call_api(api_op.action, api_op.client)
+                    applied.append(api_op)
+            except Exception as e:
+                logger.exception('Не удалось применить изменения пользователей Xray на %s', self.server)
+                self.failed_mutations[mutation] = e
+                failed = True
+                self._undo_live(applied)
+                for api_op in reversed(group_ops):
+                    self._undo_in_conf(api_op)
+        return failed
+
+    def _call_api(self, action: str, client: dict):
+        if action == 'add':
+            try:
+                XrayAPI.add_user(
+                    server_address=self.api_address,
+                    inbound_tag=self.inbound_tag,
+                    email=client['email'],
+                    user_id=client['id'],
+                    level=0,
+                )
+            except EmailExistsError:
+                logger.info('Пользователь %s уже есть в Xray на %s', client['email'], self.server)
+        else:
+            try:
+                XrayAPI.remove_user(
+                    server_address=self.api_address,
+                    inbound_tag=self.inbound_tag,
+                    email=client['email'],
+                )
+            except UserNotFoundError:
+                logger.info('Пользователя %s уже нет в Xray на %s', client['email'], self.server)
+
+    def _undo_live(self, applied: list[ApiOp]):
+        for api_op in reversed(applied):
+            try:
+                self._call_api('remove' if api_op.action == 'add' else 'add', api_op.client)
+            except Exception:
+                # конфиг уже не совпадает с Xray: расхождение исправит reconcile_xray
+                logger.exception(
+                    'Не удалось отменить изменение пользователя %s на %s',
+                    api_op.client['email'],
+                    self.server,
+                )
+
+    def _undo_in_conf(self, api_op: ApiOp):
+        client_id = api_op.client['id']
+        if api_op.action == 'add':
+            self.clients[:] = [c for c in self.clients if c['id'] != client_id]
+            if self.server_protocol.is_clients_table_supported:
+                self._set_table([c for c in self.table if c['clientId'] != client_id])
+        elif api_op.in_conf:
+            self.clients.append(api_op.client)
+            if api_op.table_entries:
+                self._set_table(self.table + api_op.table_entries)
+        self._mark_conf_dirty()
+
     def add_client(self, username: str) -> tuple[str, str]:
         client_id = str(uuid.uuid4())
         now = timezone.now()
@@ -33,79 +167,69 @@ class XRayManager(BaseConfigManager):
             )
 
         # Обновляем основной файл конфигурации
-        with open(self.local_conf) as f:
-            server = json.load(f)
-        server['inbounds'][0]['settings']['clients'].append(
-            {
-                'id': client_id,
-                'email': client_name,
-                'flow': 'xtls-rprx-vision',
-                'level': 0,
-            },
-        )
-        with open(self.local_conf, 'w') as f:
-            json.dump(server, f, indent=4)
-        self._save_conf()
-
-        XrayAPI.add_user(
-            server_address=f'{self.server.host}:10085',
-            inbound_tag='vless-inbound',
-            email=client_name,
-            user_id=client_id,
-            level=0,
-        )
+        client = {
+            'id': client_id,
+            'email': client_name,
+            'flow': 'xtls-rprx-vision',
+            'level': 0,
+        }
+        self.clients.append(client)
+        self._mark_conf_dirty()
 
         # вместо перезапуска просто сообщаем XRAY о новом пользователе через gRPC
-        self.should_restart = False
+        self._pending_api_ops.append(ApiOp('add', client, self._mutation))
 
         return client_id, client_name
 
     def remove_client(self, client_id):
+        table_entries = []
         if self.server_protocol.is_clients_table_supported:
             # Обновляем clientsTable
-            with open(self.local_table) as f:
-                table = json.load(f)
-            table = [c for c in table if c['clientId'] != client_id]
-            with open(self.local_table, 'w') as f:
-                json.dump(table, f, indent=4)
-            self._save_table()
+            table_entries = [c for c in self.table if c['clientId'] == client_id]
+            self._set_table([c for c in self.table if c['clientId'] != client_id])
 
         # Обновляем основной файл конфигурации
-        self.disable_client(client_id)
+        self._drop_client(client_id, table_entries)
 
     def disable_client(self, client_id):
-        with open(self.local_conf) as f:
-            server = json.load(f)
-
-        clients = server['inbounds'][0]['settings']['clients']
-        server['inbounds'][0]['settings']['clients'] = [c for c in clients if c['id'] != client_id]
-
-        with open(self.local_conf, 'w') as f:
-            json.dump(server, f, indent=4)
-        self._save_conf()
+        self._drop_client(client_id, [])
+
+    def _drop_client(self, client_id, table_entries: list[dict]):
+        removed = [c for c in self.clients if c['id'] == client_id]
+        if not removed:
+            return  # уже отключён
+        self.clients[:] = [c for c in self.clients if c['id'] != client_id]
+        self._mark_conf_dirty()
+        for client in removed:
+            self._pending_api_ops.append(ApiOp('remove', client, self._mutation, table_entries))
+            table_entries = []
+
+    def remove_unknown_client(self, client_id: str, email: str):
+        """Удалить клиента, для которого нет записи в БД, и из конфига, и из работающего Xray."""
+        if any(c['id'] == client_id and c['email'] == email for c in self.clients):
+            self.remove_client(client_id)
+        else:
+            # клиент есть только в работающем Xray (например, добавлен вручную через API)
+            self._pending_api_ops.append(
+                ApiOp('remove', {'id': client_id, 'email': email}, self._mutation, in_conf=False),
+            )
 
     def enable_client(self, client_id, client_name):
         # Проверяем, есть ли уже в основном файле конфигурации (может быть включён)
-        with open(self.local_conf) as f:
-            server = json.load(f)
-
-        existing_ids = {c['id'] for c in server['inbounds'][0]['settings']['clients']}
+        existing_ids = {c['id'] for c in self.clients}
         if client_id in existing_ids:
             return  # уже включён
 
         # Добавляем
-        server['inbounds'][0]['settings']['clients'].append(
-            {
-                'id': client_id,
-                'email': client_name,
-                'flow': 'xtls-rprx-vision',
-                'level': 0,
-            },
-        )
-
-        with open(self.local_conf, 'w') as f:
-            json.dump(server, f, indent=4)
-        self._save_conf()
+        client = {
+            'id': client_id,
+            'email': client_name,
+            'flow': 'xtls-rprx-vision',
+            'level': 0,
+        }
+        self.clients.append(client)
+        self._mark_conf_dirty()
+        self._pending_api_ops.append(ApiOp('add', client, self._mutation))
 
     @staticmethod
     def get_vless_url_template():
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0020_vlessconfig_config_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverprotocol',
+            name='container_transfer_mode',
+            field=models.CharField(choices=[('stream', 'docker exec (один запрос)'), ('copy', 'docker cp через временный файл')], default='copy', help_text='Способ передачи файлов в контейнер, если volumes не поддерживаются (docker exec включается явно)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0021_serverprotocol_container_transfer_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Начало часа или дня, к которому относится трафик')),
+                ('uplink', models.BigIntegerField(default=0, help_text='Отправлено клиентом, байт')),
+                ('downlink', models.BigIntegerField(default=0, help_text='Получено клиентом, байт')),
+                ('config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='traffic_stats', to='vpn.vlessconfig')),
+            ],
+            options={
+                'verbose_name': 'Статистика трафика',
+                'verbose_name_plural': 'Статистика трафика',
+                'constraints': [models.UniqueConstraint(fields=('config', 'period', 'bucket'), name='unique_traffic_bucket')],
+            },
+        ),
+    ]
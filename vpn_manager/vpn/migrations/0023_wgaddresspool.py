@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:16
+
+import django.db.models.deletion
+import vpn.models.servers
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0022_trafficstat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverprotocol',
+            name='wg_subnet',
+            field=models.CharField(default='10.8.1.0/24', help_text='(только для AmneziaWG) Подсеть, из которой выдаются адреса клиентам', max_length=18, validators=[vpn.models.servers.validate_ipv4_subnet]),
+        ),
+        migrations.CreateModel(
+            name='WGAddressPool',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subnet', models.CharField(max_length=18)),
+                ('bitmap', models.BinaryField(default=b'')),
+                ('next_free', models.PositiveIntegerField(default=0)),
+                ('server_protocol', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='address_pool', to='vpn.serverprotocol')),
+            ],
+            options={
+                'verbose_name': 'Пул адресов AmneziaWG',
+                'verbose_name_plural': 'Пулы адресов AmneziaWG',
+            },
+        ),
+    ]
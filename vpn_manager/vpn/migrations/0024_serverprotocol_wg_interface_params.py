@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0023_wgaddresspool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serverprotocol',
+            name='wg_interface_params',
+            field=models.JSONField(blank=True, default=dict, help_text='(только для AmneziaWG) Параметры обфускации интерфейса (Jc, Jmin, …, H4), кешируются из конфига сервера при каждом его чтении'),
+        ),
+    ]
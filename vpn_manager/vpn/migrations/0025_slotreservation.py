@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0024_serverprotocol_wg_interface_params'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='vpn.vpnserver')),
+            ],
+            options={
+                'verbose_name': 'Резерв слота',
+                'verbose_name_plural': 'Резервы слотов',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0025_slotreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisioningJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('vless', 'VLESS-конфиг'), ('amneziawg', 'AmneziaWG-конфиг')], max_length=20)),
+                ('idempotency_key', models.CharField(help_text='Повторная постановка задачи с тем же ключом возвращает уже существующую', max_length=255, unique=True)),
+                ('expires_at', models.DateTimeField(blank=True, help_text='Срок действия конфига', null=True)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('chat_id', models.BigIntegerField(blank=True, null=True)),
+                ('message_id', models.BigIntegerField(blank=True, help_text='Сообщение о ходе выдачи, которое воркер заменит результатом', null=True)),
+                ('config_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='provisioning_jobs', to='vpn.vpnuser')),
+            ],
+            options={
+                'verbose_name': 'Задача выдачи конфига',
+                'verbose_name_plural': 'Задачи выдачи конфигов',
+                'indexes': [models.Index(fields=['status', 'run_after'], name='provisioningjob_queue_idx')],
+            },
+        ),
+    ]
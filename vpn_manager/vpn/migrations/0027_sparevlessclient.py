@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0026_provisioningjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpareVLESSClient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.UUIDField(unique=True)),
+                ('config_email', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spare_vless_clients', to='vpn.vpnserver')),
+            ],
+            options={
+                'verbose_name': 'Резервный VLESS-клиент',
+                'verbose_name_plural': 'Резервные VLESS-клиенты',
+            },
+        ),
+    ]
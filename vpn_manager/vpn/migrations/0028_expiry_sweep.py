@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0027_sparevlessclient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisioningjob',
+            name='payload',
+            field=models.JSONField(blank=True, default=dict, help_text='Данные задачи, например текст'),
+        ),
+        migrations.AlterField(
+            model_name='provisioningjob',
+            name='kind',
+            field=models.CharField(choices=[('vless', 'VLESS-конфиг'), ('amneziawg', 'AmneziaWG-конфиг'), ('expiry_reminder', 'Напоминание об истечении')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='amneziawgconfig',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='amneziawgconfig_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vlessconfig',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='vlessconfig_expires_idx'),
+        ),
+    ]
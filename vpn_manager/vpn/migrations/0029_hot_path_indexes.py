@@ -0,0 +1,50 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0028_expiry_sweep'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='amneziawgconfig',
+            name='server',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='vpn.vpnserver'),
+        ),
+        migrations.AlterField(
+            model_name='amneziawgconfig',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='vpn.vpnuser'),
+        ),
+        migrations.AlterField(
+            model_name='vlessconfig',
+            name='server',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='vpn.vpnserver'),
+        ),
+        migrations.AlterField(
+            model_name='vlessconfig',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='vpn.vpnuser'),
+        ),
+        migrations.AddIndex(
+            model_name='amneziawgconfig',
+            index=models.Index(fields=['server', 'is_active'], name='amneziawgconfig_srv_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='amneziawgconfig',
+            index=models.Index(fields=['user', 'is_active'], name='amneziawgconfig_user_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vlessconfig',
+            index=models.Index(fields=['server', 'is_active'], name='vlessconfig_srv_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vlessconfig',
+            index=models.Index(fields=['user', 'is_active'], name='vlessconfig_user_act_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0029_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=128, unique=True)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Лимит запросов',
+                'verbose_name_plural': 'Лимиты запросов',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpn', '0030_rate_limit_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vlessconfig',
+            name='from_spare',
+            field=models.BooleanField(default=False, editable=False, help_text='Клиент выдан из пула резервных'),
+        ),
+    ]
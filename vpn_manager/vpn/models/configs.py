@@ -1,20 +1,30 @@
-from collections.abc import Callable
+import logging
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import close_old_connections, connection, models, transaction
+from django.db.models import Q
 from django.utils import timezone
 from vpn.managers.amneziawg_manager import WGManager
+from vpn.managers.mutation_queue import submit_mutation
 from vpn.managers.vless_manager import XRayManager
-from vpn.models.servers import VPNServer
+from vpn.models.servers import SlotReservation, VPNServer
 from vpn.models.users import VPNUser
 from vpn.utils.amneziawg_utils import generate_wg_config, get_existing_wg_config, remove_wg_config
 from vpn.utils.vless_utils import generate_vless_config, get_vless_url_by_id, remove_vless_config
 
 
+logger = logging.getLogger(__name__)
+
+CONFIG_LIMIT_ERROR = 'config_limit'
+
+
 def handle_config_generation(func):
     @wraps(func)
-    def wrapper(self: 'VLESSConfig | AmneziaWGConfig', *args, **kwargs):
+    def wrapper(self: 'VLESSConfig | AmneziaWGConfig', *args, on_insert: Callable | None = None, **kwargs):
         is_new = self._state.adding  # type: ignore
         old_active = None
 
@@ -22,30 +32,46 @@ def handle_config_generation(func):
             old = type(self).objects.get(pk=self.pk)
             old_active = old.is_active
 
-        # если создаётся новый конфиг — выбираем свободный сервер и вызываем специфичный для класса генератор
+        # если создаётся новый конфиг — резервируем слот на сервере и вызываем специфичный для класса генератор
         if is_new:
-            server = VPNServer.get_least_loaded()
-            if not server:
-                raise RuntimeError('Нет доступных серверов для выдачи конфигов')
-            self.server = server
-            self._handle_config_generation()
-
-        self.full_clean()
-        func(self, *args, **kwargs)
+            reservation = SlotReservation.reserve()
+            self.server = reservation.server
+            try:
+                self._handle_config_generation()
+                self.full_clean()
+                # резерв снимается в той же транзакции, в которой появляется конфиг: слот не бывает свободен дважды.
+                # on_insert выполняется в ней же, например чтобы связать конфиг с задачей выдачи
+                with transaction.atomic():
+                    func(self, *args, **kwargs)
+                    if on_insert is not None:
+                        on_insert(self)
+                    reservation.release()
+            except Exception:
+                reservation.release()
+                try:
+                    self._discard_generated()
+                except Exception:
+                    logger.exception('Не удалось вернуть сгенерированного клиента %s в пул', self.client_id)
+                raise
+        else:
+            self.full_clean()
+            func(self, *args, **kwargs)
 
         # если объект уже был, и поменяли is_active — синхронизируем сервер
         if not is_new and old_active != self.is_active:
-            with type(self)._config_manager(self.server) as mgr:  # noqa: SLF001
-                if self.is_active:
-                    mgr.enable_client(str(self.client_id), self.config_email if isinstance(self, VLESSConfig) else None)
-                else:
-                    mgr.disable_client(str(self.client_id))
+            submit_mutation(type(self)._config_manager, self.server, self._sync_active)  # noqa: SLF001
 
     return wrapper
 
 
 class BaseVPNConfig(models.Model):
-    user: models.ForeignKey[VPNUser] = models.ForeignKey('VPNUser', on_delete=models.CASCADE, related_name='%(class)ss')  # type: ignore[type-arg]
+    # отдельные индексы по FK не нужны: их покрывают составные индексы (user, is_active) и (server, is_active)
+    user: models.ForeignKey[VPNUser] = models.ForeignKey(  # type: ignore[type-arg]
+        'VPNUser',
+        on_delete=models.CASCADE,
+        related_name='%(class)ss',
+        db_index=False,
+    )
     created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
     expires_at: models.DateTimeField = models.DateTimeField(
         blank=True,
@@ -56,6 +82,7 @@ class BaseVPNConfig(models.Model):
         VPNServer,
         on_delete=models.CASCADE,
         related_name='%(class)ss',
+        db_index=False,
     )
 
     _remove_config: Callable
@@ -63,6 +90,14 @@ class BaseVPNConfig(models.Model):
 
     class Meta:
         abstract = True
+        indexes = (
+            # подсчёт конфигов сервера и выборка активных клиентов для сверки с Xray
+            models.Index(fields=('server', 'is_active'), name='%(class)s_srv_act_idx'),
+            # конфиги пользователя: /configs, лимиты, деактивация
+            models.Index(fields=('user', 'is_active'), name='%(class)s_user_act_idx'),
+            # поиск истёкших и скоро истекающих активных конфигов
+            models.Index(fields=('expires_at',), condition=Q(is_active=True), name='%(class)s_expires_idx'),
+        )
 
     def clean(self):
         if not self.user_id:  # type: ignore
@@ -78,12 +113,27 @@ class BaseVPNConfig(models.Model):
                 raise ValidationError(
                     f'У пользователя уже {current} конфигов, '
                     f'что достигло его лимита {self.user.available_configs_count}.',
+                    code=CONFIG_LIMIT_ERROR,
                 )
 
     def _handle_config_generation(self):
         """Шаблонный метод для генерации конфигурации."""
         raise NotImplementedError
 
+    def _discard_generated(self):
+        """Вызывается, если конфиг не удалось сохранить после генерации."""
+
+    def _sync_active(self, mgr: XRayManager | WGManager, is_active: bool | None = None):  # noqa: FBT001
+        """Применить `is_active` (по умолчанию — текущий флаг) к клиенту в открытой сессии менеджера."""
+        if self.is_active if is_active is None else is_active:
+            mgr.enable_client(str(self.client_id), self._client_name)  # type: ignore[attr-defined]
+        else:
+            mgr.disable_client(str(self.client_id))  # type: ignore[attr-defined]
+
+    @property
+    def _client_name(self) -> str | None:
+        return None
+
     @handle_config_generation
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
@@ -106,14 +156,44 @@ class VLESSConfig(BaseVPNConfig):
     config_email: models.CharField = models.CharField(
         help_text='Email для конфига (используется для сбора статистики, добавляется автоматически)',
     )
+    from_spare: models.BooleanField = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text='Клиент выдан из пула резервных',
+    )
     _vless_url: str
+    _spare: 'SpareVLESSClient | None'
 
     _remove_config = remove_vless_config
     _config_manager = XRayManager
 
     def _handle_config_generation(self):
+        # заранее зарегистрированный в Xray клиент выдаётся без обращения к серверу
+        self._spare = SpareVLESSClient.take(self.server)
+        self.from_spare = self._spare is not None
+        if self._spare is not None:
+            self.client_id, self.config_email = self._spare.client_id, self._spare.config_email
+            _, self._vless_url = get_vless_url_by_id(self.client_id, self.user.username, self.server)
+            return
         self.client_id, self.config_email, self._vless_url = generate_vless_config(self.user.username, self.server)
 
+    def _discard_generated(self):
+        # клиент уже есть в config.json и Xray: возвращаем его в пул, а не оставляем без записи в БД
+        spare = getattr(self, '_spare', None)
+        if spare is not None:
+            spare.pk = None
+            spare.save()
+        elif self.client_id:
+            SpareVLESSClient.objects.create(
+                server=self.server,
+                client_id=self.client_id,
+                config_email=self.config_email,
+            )
+
+    @property
+    def _client_name(self) -> str:
+        return self.config_email
+
     @property
     def generated_url(self):
         return self._vless_url
@@ -125,6 +205,44 @@ class VLESSConfig(BaseVPNConfig):
         return f'VLESS config for {self.user.username} (Expires: {self.expires_at})'
 
 
+class SpareVLESSClient(models.Model):
+    """Клиент, уже добавленный в Xray на сервере, но ещё не выданный пользователю.
+
+    Пул пополняет команда `fill_spare_clients`, а новый VLESSConfig забирает клиента из пула
+    вместо записи на сервер. Email в Xray при выдаче не меняется: по нему собирается статистика.
+    """
+
+    server: models.ForeignKey[VPNServer] = models.ForeignKey(  # type: ignore[type-arg]
+        VPNServer,
+        on_delete=models.CASCADE,
+        related_name='spare_vless_clients',
+    )
+    client_id: models.UUIDField = models.UUIDField(unique=True)
+    config_email: models.CharField = models.CharField(max_length=255)
+    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Резервный VLESS-клиент'
+        verbose_name_plural = 'Резервные VLESS-клиенты'
+
+    def __str__(self):
+        return f'{self.config_email} ({self.server.name})'
+
+    @classmethod
+    def take(cls, server: VPNServer) -> 'SpareVLESSClient | None':
+        """Забрать самого старого свободного клиента сервера."""
+        with transaction.atomic():
+            spare = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(server=server)
+                .order_by('created_at', 'pk')
+                .first()
+            )
+            if spare is not None:
+                spare.delete()
+        return spare
+
+
 class AmneziaWGConfig(BaseVPNConfig):
     client_id: models.CharField = models.CharField(
         max_length=255,
@@ -141,27 +259,26 @@ class AmneziaWGConfig(BaseVPNConfig):
         blank=True,
         help_text='IP-адрес, разрешенный для этого клиента',
     )
-    _tmp_filepath: str
+    _client_conf: bytes
 
     _remove_config = remove_wg_config
     _config_manager = WGManager
 
     def _handle_config_generation(self):
-        pub, priv, _, ip, filepath = generate_wg_config(f'{self.user.username}_{timezone.now():%d-%m-%Y}', self.server)
+        pub, priv, _, ip, conf = generate_wg_config(f'{self.user.username}_{timezone.now():%d-%m-%Y}', self.server)
         self.client_id = pub
         self.private_key = priv
         self.allowed_ip = ip
-        self._tmp_filepath = str(filepath)
+        self._client_conf = conf
 
     @property
-    def tmp_filepath(self):
-        return self._tmp_filepath
+    def client_conf(self) -> bytes:
+        return self._client_conf
 
-    def get_existing_config(self):
+    def get_existing_config(self) -> bytes:
         return get_existing_wg_config(
             self.client_id,
             self.private_key,
-            self.user.username,
             self.server,
             allowed_ip=self.allowed_ip,
         )
@@ -170,6 +287,51 @@ class AmneziaWGConfig(BaseVPNConfig):
         return f'AmneziaWG config for {self.user.username} (Expires: {self.expires_at})'
 
 
+def set_configs_active(configs: Iterable[BaseVPNConfig], *, is_active: bool) -> tuple[int, list[VPNServer]]:
+    """Включить или отключить конфиги пачкой.
+
+    Конфиги группируются по серверу и протоколу: на каждый сервер приходится одна сессия менеджера
+    (одна запись конфига и одно применение изменений), сервера обрабатываются параллельно, а флаг
+    в БД обновляется одним UPDATE на группу. Флаг меняется только у конфигов, изменения которых
+    применены на сервере. Возвращает число изменённых конфигов и сервера с ошибками.
+    """
+    groups: dict[tuple[type[BaseVPNConfig], int], list[BaseVPNConfig]] = defaultdict(list)
+    for config in configs:
+        if config.is_active != is_active:
+            groups[type(config), config.server_id].append(config)  # type: ignore[attr-defined]
+    if not groups:
+        return 0, []
+
+    servers = VPNServer.objects.in_bulk({server_id for _, server_id in groups})
+
+    def apply(model: type[BaseVPNConfig], server: VPNServer, group: list[BaseVPNConfig]):
+        def sync(mgr):
+            for config in group:
+                config._sync_active(mgr, is_active)  # noqa: SLF001
+
+        # поток пула не должен оставлять за собой открытых соединений с БД
+        close_old_connections()
+        try:
+            submit_mutation(model._config_manager, server, sync)  # noqa: SLF001
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        futures = {key: executor.submit(apply, key[0], servers[key[1]], group) for key, group in groups.items()}
+
+    updated, failed = 0, []
+    for (model, server_id), future in futures.items():
+        if future.exception() is not None:
+            logger.error('Не удалось изменить конфиги на сервере %s: %s', servers[server_id], future.exception())
+            failed.append(servers[server_id])
+            continue
+        group = groups[model, server_id]
+        for config in group:
+            config.is_active = is_active
+        updated += model.objects.filter(pk__in=[config.pk for config in group]).update(is_active=is_active)
+    return updated, failed
+
+
 MODEL_MAP = {
     'VLESSConfig': VLESSConfig,
     'AmneziaWGConfig': AmneziaWGConfig,
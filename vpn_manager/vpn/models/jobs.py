@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+from vpn.models.users import VPNUser
+
+
+class ProvisioningJob(models.Model):
+    """Фоновая задача для воркера `run_provisioning_worker`: выдача конфига или уведомление пользователя.
+
+    Таблица служит очередью: воркеры забирают задачи через `select_for_update(skip_locked=True)`,
+    поэтому их можно запускать сколько угодно отдельно от бота.
+    """
+
+    VLESS = 'vless'
+    AMNEZIAWG = 'amneziawg'
+    EXPIRY_REMINDER = 'expiry_reminder'
+    KIND_CHOICES = (
+        (VLESS, 'VLESS-конфиг'),
+        (AMNEZIAWG, 'AmneziaWG-конфиг'),
+        (EXPIRY_REMINDER, 'Напоминание об истечении'),
+    )
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+    ACTIVE_STATUSES = (PENDING, RUNNING)
+
+    kind: models.CharField = models.CharField(max_length=20, choices=KIND_CHOICES)
+    user: models.ForeignKey[VPNUser] = models.ForeignKey(  # type: ignore[type-arg]
+        VPNUser,
+        on_delete=models.CASCADE,
+        related_name='provisioning_jobs',
+    )
+    idempotency_key: models.CharField = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text='Повторная постановка задачи с тем же ключом возвращает уже существующую',
+    )
+    expires_at: models.DateTimeField = models.DateTimeField(null=True, blank=True, help_text='Срок действия конфига')
+    status: models.CharField = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    max_attempts: models.PositiveIntegerField = models.PositiveIntegerField(default=5)
+    run_after: models.DateTimeField = models.DateTimeField(default=timezone.now)
+    locked_at: models.DateTimeField = models.DateTimeField(null=True, blank=True)
+
+    # куда отправить результат в Telegram
+    chat_id: models.BigIntegerField = models.BigIntegerField(null=True, blank=True)
+    message_id: models.BigIntegerField = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text='Сообщение о ходе выдачи, которое воркер заменит результатом',
+    )
+
+    config_id: models.PositiveIntegerField = models.PositiveIntegerField(null=True, blank=True)
+    payload: models.JSONField = models.JSONField(default=dict, blank=True, help_text='Данные задачи, например текст')
+    last_error: models.TextField = models.TextField(blank=True)
+    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    updated_at: models.DateTimeField = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Задача выдачи конфига'
+        verbose_name_plural = 'Задачи выдачи конфигов'
+        indexes = (models.Index(fields=('status', 'run_after'), name='provisioningjob_queue_idx'),)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} для {self.user} ({self.get_status_display()})'  # type: ignore[attr-defined]
+
+    @classmethod
+    def enqueue(cls, user: VPNUser, kind: str, idempotency_key: str, **fields) -> tuple['ProvisioningJob', bool]:
+        """Поставить задачу в очередь. Возвращает (задача, создана ли новая)."""
+        try:
+            with transaction.atomic():
+                return cls.objects.create(user=user, kind=kind, idempotency_key=idempotency_key, **fields), True
+        except IntegrityError:
+            return cls.objects.get(idempotency_key=idempotency_key), False
+
+    @classmethod
+    def active_for(cls, user: VPNUser, kind: str) -> 'ProvisioningJob | None':
+        return cls.objects.filter(user=user, kind=kind, status__in=cls.ACTIVE_STATUSES).first()
+
+    @classmethod
+    def claim(cls, limit: int, stale_after: timedelta) -> list['ProvisioningJob']:
+        """Забрать до `limit` готовых к выполнению задач.
+
+        Задачи в статусе RUNNING, которые не завершились за `stale_after` (воркер упал), забираются повторно.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('user')
+                .filter(
+                    Q(status=cls.PENDING, run_after__lte=now) | Q(status=cls.RUNNING, locked_at__lt=now - stale_after),
+                )
+                .order_by('run_after', 'pk')[:limit],
+            )
+            for job in jobs:
+                job.status = cls.RUNNING
+                job.locked_at = now
+                job.attempts += 1
+                job.updated_at = now  # bulk_update не обновляет auto_now поля
+            cls.objects.bulk_update(jobs, ['status', 'locked_at', 'attempts', 'updated_at'])
+        return jobs
+
+    def mark_done(self, config_id: int | None = None):
+        """Завершить задачу. Без `config_id` уже записанная ссылка на конфиг сохраняется."""
+        self.status = self.DONE
+        if config_id is not None:
+            self.config_id = config_id
+        self.locked_at = None
+        self.save(update_fields=['status', 'config_id', 'locked_at', 'updated_at'])
+
+    def mark_failed(self, error: str, *, retry: bool, backoff: timedelta) -> datetime | None:
+        """Записать ошибку и вернуть время следующей попытки, если она будет."""
+        self.last_error = error
+        self.locked_at = None
+        if retry and self.attempts < self.max_attempts:
+            self.status = self.PENDING
+            # экспоненциальная задержка: backoff, 2*backoff, 4*backoff, ...
+            self.run_after = timezone.now() + backoff * 2 ** (self.attempts - 1)
+        else:
+            self.status = self.FAILED
+        self.save(update_fields=['status', 'last_error', 'locked_at', 'run_after', 'updated_at'])
+        return self.run_after if self.status == self.PENDING else None
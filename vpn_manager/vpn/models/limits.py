@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class RateLimitBucket(models.Model):
+    """Состояние token bucket ограничителя запросов бота (используется при RATE_LIMIT_PERSIST).
+
+    Хранится в БД, чтобы лимиты переживали перезапуск бота и были общими для всех воркеров webhook.
+    """
+
+    key: models.CharField = models.CharField(max_length=128, unique=True)
+    tokens: models.FloatField = models.FloatField()
+    updated_at: models.DateTimeField = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Лимит запросов'
+        verbose_name_plural = 'Лимиты запросов'
+
+    def __str__(self):
+        return f'{self.key}: {self.tokens:.2f}'
@@ -1,4 +1,57 @@
-from django.db import models
+import ipaddress
+from collections.abc import Callable, Iterable
+from datetime import timedelta
+
+from config.env_constants import SLOT_RESERVATION_TTL
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+
+def validate_ipv4_subnet(value: str):
+    try:
+        ipaddress.IPv4Network(value)
+    except ValueError as e:
+        raise ValidationError(f'Некорректная подсеть {value}: {e}') from e
+
+
+def _configs_count(model_name: str) -> Coalesce:
+    # подзапрос вместо JOIN, чтобы не перемножать строки VLESS и AmneziaWG конфигов
+    model = apps.get_model('vpn', model_name)
+    counts = model.objects.filter(server=OuterRef('pk')).order_by().values('server').annotate(count=Count('pk'))
+    return Coalesce(Subquery(counts.values('count')), 0)
+
+
+def _reservations_count() -> Coalesce:
+    counts = (
+        SlotReservation.objects.filter(server=OuterRef('pk'), expires_at__gt=Now())
+        .order_by()
+        .values('server')
+        .annotate(count=Count('pk'))
+    )
+    return Coalesce(Subquery(counts.values('count')), 0)
+
+
+class VPNServerQuerySet(models.QuerySet):
+    def with_load(self) -> 'VPNServerQuerySet':
+        """Добавить к серверам счётчики нагрузки одним запросом.
+
+        `issued_count` — выданные конфиги, `spare_count` — резервные VLESS-клиенты, которые уже есть на сервере,
+        `reserved_count` — активные резервы слотов, `free_slots` — место для новых клиентов.
+        """
+        return self.annotate(
+            issued_count=_configs_count('VLESSConfig') + _configs_count('AmneziaWGConfig'),
+            spare_count=_configs_count('SpareVLESSClient'),
+            reserved_count=_reservations_count(),
+            free_slots=F('max_configs') - F('issued_count') - F('spare_count') - F('reserved_count'),
+        )
+
+    def placeable(self) -> 'VPNServerQuerySet':
+        """Сервера, на которые можно выдать конфиг: есть свободный слот или незанятый резервный клиент."""
+        return self.with_load().filter(Q(free_slots__gt=0) | Q(spare_count__gt=F('reserved_count')))
 
 
 class VPNServer(models.Model):
@@ -23,6 +76,14 @@ class VPNServer(models.Model):
     is_active: models.BooleanField = models.BooleanField(default=True)
     created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
 
+    # Заполняется VPNServerQuerySet.with_load()
+    issued_count: int
+    spare_count: int
+    reserved_count: int
+    free_slots: int
+
+    objects = VPNServerQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'VPN сервер'
         verbose_name_plural = 'VPN сервера'
@@ -33,29 +94,37 @@ class VPNServer(models.Model):
     @property
     def issued_configs(self) -> int:
         """Сколько конфигов реально выдано для этого сервера."""
+        issued = getattr(self, 'issued_count', None)
+        if issued is not None:
+            return issued
         vless_count = self.vlessconfigs.count()  # type: ignore
         wg_count = self.amneziawgconfigs.count()  # type: ignore
         return vless_count + wg_count
 
+    @property
+    def spare_clients(self) -> int:
+        """Сколько резервных клиентов уже добавлено на сервер."""
+        spares = getattr(self, 'spare_count', None)
+        if spares is not None:
+            return spares
+        return self.spare_vless_clients.count()  # type: ignore
+
     @property
     def available_slots(self) -> int:
-        """Сколько еще можно выдать конфигов."""
-        return max(0, self.max_configs - self.issued_configs)
+        """Сколько еще можно добавить клиентов с учётом резервных клиентов и резервов слотов."""
+        free = getattr(self, 'free_slots', None)
+        if free is None:
+            free = self.max_configs - self.issued_configs - self.spare_clients
+        return max(0, free)
 
     @property
     def is_overloaded(self) -> bool:
-        return self.issued_configs >= self.max_configs
+        return self.issued_configs + self.spare_clients >= self.max_configs
 
     @classmethod
     def get_least_loaded(cls) -> 'VPNServer | None':
-        """Вернуть сервер с наибольшим числом свободных слотов."""
-        servers = cls.objects.filter(is_active=True)
-        if not servers.exists():
-            return None
-        least_loaded_server = min(servers, key=lambda s: s.issued_configs)
-        if least_loaded_server.is_overloaded:
-            return None
-        return least_loaded_server
+        """Вернуть сервер с наибольшим числом свободных слотов, на который можно выдать конфиг."""
+        return cls.objects.filter(is_active=True).placeable().order_by('-free_slots', 'pk').first()
 
 
 class ServerProtocol(models.Model):
@@ -66,6 +135,13 @@ class ServerProtocol(models.Model):
         (AMNEZIAWG, 'AmneziaWG'),
     )
 
+    TRANSFER_STREAM = 'stream'
+    TRANSFER_COPY = 'copy'
+    TRANSFER_MODE_CHOICES = (
+        (TRANSFER_STREAM, 'docker exec (один запрос)'),
+        (TRANSFER_COPY, 'docker cp через временный файл'),
+    )
+
     server: models.ForeignKey[VPNServer] = models.ForeignKey(  # type: ignore[type-arg]
         VPNServer,
         on_delete=models.CASCADE,
@@ -101,6 +177,18 @@ class ServerProtocol(models.Model):
         blank=True,
         help_text='(только для AmneziaWG) Общий ключ WireGuard',
     )
+    wg_subnet: models.CharField = models.CharField(
+        max_length=18,
+        default='10.8.1.0/24',
+        validators=[validate_ipv4_subnet],
+        help_text='(только для AmneziaWG) Подсеть, из которой выдаются адреса клиентам',
+    )
+    wg_interface_params: models.JSONField = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text='(только для AmneziaWG) Параметры обфускации интерфейса (Jc, Jmin, …, H4), '
+        'кешируются из конфига сервера при каждом его чтении',
+    )
 
     is_clients_table_supported: models.BooleanField = models.BooleanField(
         default=False,
@@ -109,6 +197,229 @@ class ServerProtocol(models.Model):
         default=True,
         help_text='Поддерживает ли сервер монтирование volumes (для AmneziaWG)',
     )
+    container_transfer_mode: models.CharField = models.CharField(
+        max_length=20,
+        choices=TRANSFER_MODE_CHOICES,
+        default=TRANSFER_COPY,
+        help_text='Способ передачи файлов в контейнер, если volumes не поддерживаются (docker exec включается явно)',
+    )
 
     def __str__(self):
         return f'{self.server.name} - {self.protocol}'
+
+
+class WGAddressPool(models.Model):
+    """Учёт выданных адресов подсети AmneziaWG в виде битовой карты.
+
+    Бит N означает, что занят N-й адрес подсети. `next_free` — подсказка: все адреса ниже
+    неё заняты, поэтому выделение начинается с неё и в среднем выполняется за O(1).
+    Изменения выполняются под блокировкой строки (`select_for_update`).
+    """
+
+    # адрес сети и адрес сервера (x.x.x.1) клиентам не выдаются, широковещательный — тоже
+    RESERVED_HEAD = 2
+
+    server_protocol: models.OneToOneField[ServerProtocol] = models.OneToOneField(  # type: ignore[type-arg]
+        ServerProtocol,
+        on_delete=models.CASCADE,
+        related_name='address_pool',
+    )
+    subnet: models.CharField = models.CharField(max_length=18)
+    bitmap: models.BinaryField = models.BinaryField(default=b'')
+    next_free: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Пул адресов AmneziaWG'
+        verbose_name_plural = 'Пулы адресов AmneziaWG'
+
+    def __str__(self):
+        return f'{self.server_protocol} {self.subnet}'
+
+    @property
+    def network(self) -> ipaddress.IPv4Network:
+        return ipaddress.IPv4Network(self.subnet)
+
+    @staticmethod
+    def _is_set(bits: bytearray, offset: int) -> bool:
+        return bool(bits[offset >> 3] & (1 << (offset & 7)))
+
+    @staticmethod
+    def _set(bits: bytearray, offset: int, *, used: bool):
+        if used:
+            bits[offset >> 3] |= 1 << (offset & 7)
+        else:
+            bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def offset_of(self, ip: str) -> int | None:
+        """Номер адреса в подсети или None для IPv6, чужих и некорректных адресов."""
+        try:
+            address = ipaddress.ip_address(ip.split('/', 1)[0].strip())
+        except ValueError:
+            return None
+        network = self.network
+        if not isinstance(address, ipaddress.IPv4Address) or address not in network:
+            return None
+        return int(address) - int(network.network_address)
+
+    def used_count(self) -> int:
+        """Сколько адресов выдано клиентам (без служебных)."""
+        return int.from_bytes(self.bitmap, 'little').bit_count() - self.RESERVED_HEAD - 1
+
+    def mark_used(self, used_ips: Iterable[str]):
+        """Отметить занятыми адреса, о которых карта не знает (например, пиры, добавленные вручную)."""
+        bits = bytearray(self.bitmap)
+        for ip in used_ips:
+            offset = self.offset_of(ip)
+            if offset is not None:
+                self._set(bits, offset, used=True)
+        self.bitmap = bytes(bits)
+        self.next_free = self.RESERVED_HEAD
+
+    def rebuild(self, used_ips: Iterable[str]):
+        """Построить карту заново по списку занятых адресов (например, пиров из конфига сервера)."""
+        size = self.network.num_addresses
+        bits = bytearray((size + 7) // 8)
+        for offset in (*range(self.RESERVED_HEAD), size - 1):
+            self._set(bits, offset, used=True)
+        for ip in used_ips:
+            offset = self.offset_of(ip)
+            if offset is not None:
+                self._set(bits, offset, used=True)
+        self.bitmap = bytes(bits)
+        self.next_free = self.RESERVED_HEAD
+
+    @classmethod
+    def _locked(
+        cls,
+        server_protocol: ServerProtocol,
+        used_ips: Callable[[], Iterable[str]],
+        peer_count: int | None,
+    ) -> 'WGAddressPool':
+        pool, created = cls.objects.select_for_update().get_or_create(
+            server_protocol=server_protocol,
+            defaults={'subnet': server_protocol.wg_subnet},
+        )
+        if created or pool.subnet != server_protocol.wg_subnet:
+            pool.subnet = server_protocol.wg_subnet
+            pool.rebuild(used_ips())
+        elif peer_count is not None and pool.used_count() < peer_count:
+            # в конфиге больше пиров, чем отмечено в карте: сверяемся со списком адресов
+            pool.mark_used(used_ips())
+        return pool
+
+    @classmethod
+    def allocate(
+        cls,
+        server_protocol: ServerProtocol,
+        used_ips: Callable[[], Iterable[str]] = tuple,
+        peer_count: int | None = None,
+    ) -> str:
+        """Атомарно занять первый свободный адрес подсети и вернуть его в виде `x.x.x.x/32`.
+
+        `used_ips` вызывается, только когда карту нужно заполнить с нуля или когда она разошлась
+        с конфигом: пиров на сервере (`peer_count`) больше, чем выданных адресов в карте.
+        """
+        with transaction.atomic():
+            pool = cls._locked(server_protocol, used_ips, peer_count)
+            ip = pool.take_free()
+            pool.save()
+        return ip
+
+    def take_free(self) -> str:
+        bits = bytearray(self.bitmap)
+        network = self.network
+        offset = self.find_free(bits, self.next_free)
+        if offset is None:
+            raise RuntimeError(f'В подсети {self.subnet} сервера {self.server_protocol.server} нет свободных адресов')
+        self._set(bits, offset, used=True)
+        self.bitmap = bytes(bits)
+        self.next_free = offset + 1
+        return f'{network[offset]}/32'
+
+    def find_free(self, bits: bytearray, start: int) -> int | None:
+        size = self.network.num_addresses
+        byte = start >> 3
+        # пропускаем полностью занятые байты, не проверяя их биты по одному
+        while byte < len(bits):
+            if bits[byte] != 0xFF:  # noqa: PLR2004
+                for offset in range(max(start, byte << 3), min((byte + 1) << 3, size)):
+                    if not self._is_set(bits, offset):
+                        return offset
+            byte += 1
+        return None
+
+    @classmethod
+    def release(cls, server_protocol: ServerProtocol, ip: str):
+        """Освободить адрес, чтобы выдать его следующему клиенту."""
+        with transaction.atomic():
+            pool = cls.objects.select_for_update().filter(server_protocol=server_protocol).first()
+            if pool is None:
+                return
+            offset = pool.offset_of(ip)
+            if offset is None or offset < cls.RESERVED_HEAD or offset >= pool.network.num_addresses - 1:
+                return
+            bits = bytearray(pool.bitmap)
+            cls._set(bits, offset, used=False)
+            pool.bitmap = bytes(bits)
+            pool.next_free = min(pool.next_free, offset)
+            pool.save()
+
+
+class SlotReservation(models.Model):
+    """Слот сервера, занятый под конфиг, который ещё создаётся.
+
+    Резерв берётся до удалённой настройки сервера и удаляется в одной транзакции с записью конфига
+    либо при ошибке. Если процесс упал, резерв перестаёт учитываться после `expires_at`.
+    """
+
+    server: models.ForeignKey[VPNServer] = models.ForeignKey(  # type: ignore[type-arg]
+        VPNServer,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+    )
+    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    expires_at: models.DateTimeField = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Резерв слота'
+        verbose_name_plural = 'Резервы слотов'
+
+    def __str__(self):
+        return f'{self.server} до {self.expires_at:%d-%m-%Y %H:%M:%S}'
+
+    @classmethod
+    def reserve(cls, ttl: float = SLOT_RESERVATION_TTL) -> 'SlotReservation':
+        """Атомарно занять слот на наименее загруженном сервере.
+
+        Кандидаты перебираются по убыванию свободных слотов. Строка сервера блокируется, и уже под
+        блокировкой число свободных слотов пересчитывается заново, поэтому параллельные запросы
+        не превышают `max_configs`. Заблокированные сервера сначала пропускаются, чтобы одновременные
+        запросы расходились по разным серверам, и только если свободных нет — ожидаются.
+        """
+        candidates = list(
+            VPNServer.objects.filter(is_active=True)
+            .placeable()
+            .order_by('-free_slots', 'pk')
+            .values_list('pk', flat=True),
+        )
+        for skip_locked in (True, False):
+            for server_id in candidates:
+                reservation = cls._reserve_on(server_id, ttl, skip_locked=skip_locked)
+                if reservation is not None:
+                    return reservation
+        raise RuntimeError('Нет доступных серверов для выдачи конфигов')
+
+    @classmethod
+    def _reserve_on(cls, server_id: int, ttl: float, *, skip_locked: bool) -> 'SlotReservation | None':
+        with transaction.atomic():
+            locked = VPNServer.objects.select_for_update(skip_locked=skip_locked).filter(pk=server_id, is_active=True)
+            if not locked.exists():
+                return None
+            if not VPNServer.objects.filter(pk=server_id).placeable().exists():
+                return None
+            now = timezone.now()
+            cls.objects.filter(server_id=server_id, expires_at__lte=now).delete()
+            return cls.objects.create(server_id=server_id, expires_at=now + timedelta(seconds=ttl))
+
+    def release(self):
+        self.delete()
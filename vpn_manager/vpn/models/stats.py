@@ -0,0 +1,29 @@
+from django.db import models
+from vpn.models.configs import VLESSConfig
+
+
+class TrafficStat(models.Model):
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = (
+        (HOUR, 'Час'),
+        (DAY, 'День'),
+    )
+
+    config: models.ForeignKey[VLESSConfig] = models.ForeignKey(  # type: ignore[type-arg]
+        VLESSConfig,
+        on_delete=models.CASCADE,
+        related_name='traffic_stats',
+    )
+    period: models.CharField = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket: models.DateTimeField = models.DateTimeField(help_text='Начало часа или дня, к которому относится трафик')
+    uplink: models.BigIntegerField = models.BigIntegerField(default=0, help_text='Отправлено клиентом, байт')
+    downlink: models.BigIntegerField = models.BigIntegerField(default=0, help_text='Получено клиентом, байт')
+
+    class Meta:
+        verbose_name = 'Статистика трафика'
+        verbose_name_plural = 'Статистика трафика'
+        constraints = (models.UniqueConstraint(fields=('config', 'period', 'bucket'), name='unique_traffic_bucket'),)
+
+    def __str__(self):
+        return f'{self.config_id} {self.period} {self.bucket:%d-%m-%Y %H:%M}'  # type: ignore[attr-defined]
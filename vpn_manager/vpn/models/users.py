@@ -1,9 +1,26 @@
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
 from itertools import chain
 
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Cast
 from django.utils import timezone
 
 
+@dataclass(frozen=True)
+class ConfigSummary:
+    """Конфиг любого протокола в списке /configs."""
+
+    model_name: str
+    id: int
+    client_id: str
+    server_name: str
+    expires_at: datetime
+    is_active: bool
+
+
 class VPNUser(models.Model):
     telegram_id: models.BigIntegerField = models.BigIntegerField(unique=True, help_text='Числовой Telegram user ID')
     username: models.CharField = models.CharField(max_length=255, help_text='Telegram-ник с @', null=True, blank=True)
@@ -21,6 +38,9 @@ class VPNUser(models.Model):
             self.username = self.username.lstrip('@')
 
     def save(self, *args, **kwargs):
+        # сервера, на которых не удалось отключить конфиги при деактивации: показываются в админке и боте.
+        # Исключение здесь не бросаем — пользователь уже сохранён, а откат транзакции разошёлся бы с серверами
+        self.config_sync_failures: list = []
         if self.pk:  # если это существующий пользователь
             old_instance = type(self).objects.get(pk=self.pk)
             is_active_changed = old_instance.is_active != self.is_active
@@ -28,11 +48,11 @@ class VPNUser(models.Model):
             # сначала сохраняем самого пользователя
             super().save(*args, **kwargs)
 
-            # если пользователь деактивирован, то деактивируем все его конфиги
+            # если пользователь деактивирован, то деактивируем все его конфиги: по одной сессии на сервер
             if is_active_changed and not self.is_active:
-                for config in self.configs:
-                    config.is_active = False
-                    config.save()
+                from vpn.models.configs import set_configs_active  # noqa: PLC0415
+
+                _, self.config_sync_failures = set_configs_active(self.configs, is_active=False)
         else:
             # для нового пользователя просто сохраняем
             super().save(*args, **kwargs)
@@ -47,6 +67,26 @@ class VPNUser(models.Model):
             ),
         )
 
+    def config_summaries(self) -> list[ConfigSummary]:
+        """Все конфиги пользователя (VLESS + AmneziaWG) с именами серверов одним запросом, активные первыми."""
+        fields = ('model_name', 'id', 'cid', 'server__name', 'expires_at', 'is_active')
+
+        def rows(queryset: models.QuerySet, model_name: str) -> models.QuerySet:
+            cid = Cast('client_id', models.CharField())
+            return queryset.annotate(model_name=Value(model_name), cid=cid).values_list(*fields)
+
+        union = rows(self.vlessconfigs.all(), 'VLESSConfig').union(  # type: ignore
+            rows(self.amneziawgconfigs.all(), 'AmneziaWGConfig'),  # type: ignore
+            all=True,
+        )
+        summaries = []
+        for model_name, pk, client_id, server_name, expires_at, is_active in union.order_by('-is_active', 'expires_at'):
+            if model_name == 'VLESSConfig':
+                # UUID приводится к строке по-разному в SQLite и PostgreSQL
+                client_id = str(uuid.UUID(client_id))  # noqa: PLW2901
+            summaries.append(ConfigSummary(model_name, pk, client_id, server_name, expires_at, is_active))
+        return summaries
+
     def total_configs(self, *, include_inactive: bool = False) -> int:
         """Возвращает общее число configs (VLESS + AmneziaWG) для пользователя.
 
@@ -1,37 +1,41 @@
 from config.env_constants import WG_PRESHARED_KEY
 
 from vpn.managers.amneziawg_manager import WGManager
-from vpn.models.servers import VPNServer
+from vpn.managers.mutation_queue import submit_mutation
+from vpn.models.servers import ServerProtocol, VPNServer
 
 
 def generate_wg_config(client_name, server: VPNServer):
-    with WGManager(server) as mgr:
+    def add(mgr: WGManager):
         priv, pub, psk = mgr.generate_wg_keys()
         ip = mgr.get_next_ip()
         mgr.add_peer(pub, psk, ip, pub, client_name)
-        conf_file = mgr.generate_client_conf_file(client_name, priv, psk, ip)
+        conf = mgr.render_client_conf(priv, psk, ip)
+        return pub, priv, psk, ip, conf
 
-    return pub, priv, psk, ip, conf_file
+    return submit_mutation(WGManager, server, add)
 
 
 def remove_wg_config(client_id, server: VPNServer):
-    with WGManager(server) as mgr:
-        mgr.remove_peer(client_id)
+    submit_mutation(WGManager, server, lambda mgr: mgr.remove_peer(client_id))
 
 
 def enable_client(client_id, server: VPNServer):
-    with WGManager(server) as mgr:
-        mgr.enable_client(client_id, None)
+    submit_mutation(WGManager, server, lambda mgr: mgr.enable_client(client_id, None))
 
 
 def disable_client(client_id, server: VPNServer):
-    with WGManager(server) as mgr:
-        mgr.disable_client(client_id)
+    submit_mutation(WGManager, server, lambda mgr: mgr.disable_client(client_id))
+
 
+def get_existing_wg_config(public_key, private_key, server: VPNServer, allowed_ip=None) -> bytes:
+    server_protocol = server.protocols.get(protocol=ServerProtocol.AMNEZIAWG)
+    # если адрес клиента и параметры интерфейса уже есть в БД, конфиг собирается без SSH
+    if allowed_ip and server_protocol.wg_interface_params:
+        return WGManager.build_client_conf(server_protocol, private_key, WG_PRESHARED_KEY, allowed_ip)
 
-def get_existing_wg_config(public_key, private_key, client_name, server: VPNServer, allowed_ip=None):
     with WGManager(server) as mgr:
         if not allowed_ip:
             allowed_ip = mgr.get_allowed_ip_from_client_id(public_key)
-        path = mgr.generate_client_conf_file(client_name, private_key, WG_PRESHARED_KEY, allowed_ip)
-    return path
+        conf = mgr.render_client_conf(private_key, WG_PRESHARED_KEY, allowed_ip)
+    return conf
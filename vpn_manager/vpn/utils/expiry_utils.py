@@ -0,0 +1,97 @@
+import logging
+from datetime import datetime, timedelta
+
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from vpn.models.configs import AmneziaWGConfig, BaseVPNConfig, VLESSConfig, set_configs_active
+from vpn.models.jobs import ProvisioningJob
+from vpn.models.servers import VPNServer
+
+
+logger = logging.getLogger(__name__)
+
+CONFIG_MODELS: tuple[type[VLESSConfig | AmneziaWGConfig], ...] = (VLESSConfig, AmneziaWGConfig)
+PROTOCOL_LABELS = {VLESSConfig: 'VLESS', AmneziaWGConfig: 'AmneziaWG'}
+# продление через бота пока не реализовано (extend_config), поэтому направляем к администратору, как и /help
+SUPPORT_CONTACT = '@ww_speeder_admin'
+
+
+def _chunks(queryset: QuerySet, chunk_size: int):
+    """Перебирать строки порциями по первичному ключу, не держа в памяти всю выборку."""
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def sweep_expired(
+    model: type[BaseVPNConfig],
+    now: datetime | None = None,
+    chunk_size: int = 1000,
+) -> tuple[int, set[VPNServer]]:
+    """Отключить истёкшие активные конфиги. На каждую порцию — одна удалённая операция на сервер."""
+    expired = model.objects.filter(is_active=True, expires_at__lte=now or timezone.now()).only(
+        'client_id',
+        'server_id',
+        'is_active',
+    )
+    deactivated, failed = 0, set()
+    # порядок по pk, поэтому в порции обычно конфиги нескольких серверов: set_configs_active сгруппирует их
+    for chunk in _chunks(expired, chunk_size):
+        updated, failed_servers = set_configs_active(chunk, is_active=False)
+        deactivated += updated
+        failed.update(failed_servers)
+    return deactivated, failed
+
+
+def queue_expiry_reminders(
+    model: type[BaseVPNConfig],
+    remind_before: timedelta,
+    now: datetime | None = None,
+    chunk_size: int = 1000,
+) -> int:
+    """Поставить в очередь напоминания по конфигам, которые истекут в ближайшие `remind_before`.
+
+    Ключ идемпотентности включает дату истечения: по каждому сроку пользователь получает одно напоминание,
+    а после продления — новое.
+    """
+    now = now or timezone.now()
+    expiring = (
+        model.objects.filter(is_active=True, expires_at__gt=now, expires_at__lte=now + remind_before)
+        .select_related('user')
+        .only('expires_at', 'user__telegram_id')
+    )
+    label = PROTOCOL_LABELS[model]
+    queued = 0
+    for chunk in _chunks(expiring, chunk_size):
+        jobs = [
+            ProvisioningJob(
+                kind=ProvisioningJob.EXPIRY_REMINDER,
+                user_id=config.user_id,  # type: ignore[attr-defined]
+                idempotency_key=f'expiry:{model.__name__}:{config.pk}:{config.expires_at:%Y%m%d}',
+                chat_id=config.user.telegram_id,
+                config_id=config.pk,
+                payload={
+                    'text': (
+                        f'⏰ Ваш {label}-конфиг истекает {timezone.localtime(config.expires_at):%d-%m-%Y}. '
+                        f'Чтобы продлить его, напишите администратору: {SUPPORT_CONTACT}'
+                    ),
+                },
+            )
+            for config in chunk
+        ]
+        existing = set(
+            ProvisioningJob.objects.filter(idempotency_key__in=[job.idempotency_key for job in jobs]).values_list(
+                'idempotency_key',
+                flat=True,
+            ),
+        )
+        new_jobs = [job for job in jobs if job.idempotency_key not in existing]
+        # ignore_conflicts на случай параллельного запуска
+        ProvisioningJob.objects.bulk_create(new_jobs, ignore_conflicts=True)
+        queued += len(new_jobs)
+    return queued
@@ -0,0 +1,116 @@
+import logging
+from functools import partial
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+from django.core.exceptions import ValidationError
+
+from vpn.models.configs import CONFIG_LIMIT_ERROR, AmneziaWGConfig, VLESSConfig
+from vpn.models.jobs import ProvisioningJob
+from vpn.models.users import VPNUser
+
+
+logger = logging.getLogger(__name__)
+
+JOB_MODELS: dict[str, type[VLESSConfig | AmneziaWGConfig]] = {
+    ProvisioningJob.VLESS: VLESSConfig,
+    ProvisioningJob.AMNEZIAWG: AmneziaWGConfig,
+}
+
+
+class PermanentJobError(Exception):
+    """Ошибка, при которой повторять задачу бессмысленно."""
+
+
+class JobAlreadyDoneError(Exception):
+    """Конфиг по задаче уже создан другим запуском: новый конфиг откатывается."""
+
+
+def wg_conf_filename(user: VPNUser) -> str:
+    return f'wg_{user.username or user.telegram_id}.conf'
+
+
+def _is_limit_error(error: ValidationError) -> bool:
+    # full_clean() собирает ошибки в словарь по полям, ошибки clean() — под NON_FIELD_ERRORS
+    groups = error.error_dict.values() if hasattr(error, 'error_dict') else [error.error_list]
+    return any(e.code == CONFIG_LIMIT_ERROR for group in groups for e in group)
+
+
+def _link_config(job: ProvisioningJob, config: VLESSConfig | AmneziaWGConfig):
+    # связь с задачей появляется в транзакции вставки конфига: повторный запуск увидит её и не создаст второй
+    linked = ProvisioningJob.objects.filter(pk=job.pk, config_id__isnull=True).update(config_id=config.pk)
+    if not linked:
+        raise JobAlreadyDoneError
+    job.config_id = config.pk
+
+
+def _linked_config(job: ProvisioningJob) -> VLESSConfig | AmneziaWGConfig | None:
+    """Конфиг, уже созданный по задаче, с данными для отправки пользователю."""
+    config_id = ProvisioningJob.objects.filter(pk=job.pk).values_list('config_id', flat=True).get()
+    if config_id is None:
+        return None
+    config = JOB_MODELS[job.kind].objects.select_related('user', 'server').filter(pk=config_id).first()
+    if isinstance(config, VLESSConfig):
+        _, config._vless_url = config.get_vless_url()  # noqa: SLF001
+    elif isinstance(config, AmneziaWGConfig):
+        config._client_conf = config.get_existing_config()  # noqa: SLF001
+    return config
+
+
+def run_job(job: ProvisioningJob) -> VLESSConfig | AmneziaWGConfig:
+    """Создать конфиг по задаче (SSH и gRPC работа выполняется внутри `save()`).
+
+    Задача может выполниться повторно: после ошибки или если её забрал другой воркер по `stale_after`.
+    Если конфиг по ней уже создан, возвращается он.
+    """
+    model = JOB_MODELS[job.kind]
+    existing = _linked_config(job)
+    if existing is not None:
+        return existing
+
+    config = model(user=job.user, expires_at=job.expires_at)
+    try:
+        config.save(on_insert=partial(_link_config, job))
+    except JobAlreadyDoneError:
+        return _linked_config(job)  # type: ignore[return-value]
+    except ValidationError as e:
+        if _is_limit_error(e):
+            raise PermanentJobError(f'🛑 Лимит конфигов ({job.user.available_configs_count}) исчерпан.') from e
+        logger.exception('Конфиг по задаче %s не прошёл проверку', job.pk)
+        raise PermanentJobError('❌ Не удалось создать конфиг. Обратитесь к администратору.') from e
+    return config
+
+
+async def notify_done(bot: Bot, job: ProvisioningJob, config: VLESSConfig | AmneziaWGConfig):
+    if job.chat_id is None:
+        return
+    if isinstance(config, VLESSConfig):
+        await _reply(bot, job, f'✅ Ваш новый VLESS-конфиг:\n```\n{config.generated_url}\n```', parse_mode='Markdown')
+        return
+    await _reply(bot, job, '✅ Конфиг успешно создан')
+    await bot.send_document(
+        chat_id=job.chat_id,
+        document=BufferedInputFile(config.client_conf, filename=wg_conf_filename(job.user)),
+        caption='✅ Ваш новый AmneziaWG-конфиг',
+    )
+
+
+async def send_reminder(bot: Bot, job: ProvisioningJob):
+    await bot.send_message(job.chat_id, job.payload['text'])
+
+
+async def notify_failed(bot: Bot, job: ProvisioningJob, text: str):
+    if job.chat_id is not None:
+        await _reply(bot, job, text)
+
+
+async def _reply(bot: Bot, job: ProvisioningJob, text: str, **kwargs):
+    # заменяем сообщение «Генерируем...», а если его уже нельзя изменить — пишем новое
+    if job.message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.message_id, **kwargs)
+        except Exception:
+            logger.warning('Не удалось изменить сообщение %s в чате %s', job.message_id, job.chat_id)
+        else:
+            return
+    await bot.send_message(job.chat_id, text, **kwargs)
@@ -0,0 +1,123 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+
+from django.db import transaction
+
+from vpn.models.limits import RateLimitBucket
+
+
+@dataclass(frozen=True)
+class BucketSpec:
+    """`capacity` запросов подряд, полностью восстанавливаются за `period` секунд."""
+
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    @classmethod
+    def parse(cls, value: str) -> 'BucketSpec':
+        """Разобрать строку вида `3/60` — 3 запроса за 60 секунд."""
+        capacity, period = value.split('/')
+        return cls(int(capacity), float(period))
+
+
+@dataclass
+class TokenBucket:
+    spec: BucketSpec
+    tokens: float
+    updated_at: float
+
+    def refill(self, now: float):
+        elapsed = max(now - self.updated_at, 0.0)
+        self.tokens = min(self.spec.capacity, self.tokens + elapsed * self.spec.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float) -> float:
+        return max(cost - self.tokens, 0.0) / self.spec.rate
+
+    @property
+    def is_full(self) -> bool:
+        return self.tokens >= self.spec.capacity
+
+
+def take(buckets: list[TokenBucket], now: float, cost: float = 1) -> float:
+    """Списать `cost` токенов сразу из всех корзин или ни из одной. Возвращает, сколько секунд ждать (0 — можно)."""
+    for bucket in buckets:
+        bucket.refill(now)
+    wait = max(bucket.wait_time(cost) for bucket in buckets)
+    if not wait:
+        for bucket in buckets:
+            bucket.tokens -= cost
+    return wait
+
+
+class MemoryRateLimiter:
+    """Корзины в памяти процесса. Полностью восстановившиеся корзины периодически удаляются."""
+
+    def __init__(self, prune_every: int = 1000):
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._calls = 0
+
+    def hit(self, limits: list[tuple[str, BucketSpec]], cost: float = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            buckets = [self._buckets.setdefault(key, TokenBucket(spec, spec.capacity, now)) for key, spec in limits]
+            wait = take(buckets, now, cost)
+            self._calls += 1
+            if self._calls % self.prune_every == 0:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now: float):
+        # полная корзина ничем не отличается от отсутствующей
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.is_full:
+                del self._buckets[key]
+
+
+class DBRateLimiter:
+    """Корзины в таблице RateLimitBucket: строки блокируются на время списания, лимиты общие для всех процессов.
+
+    Корзины, не менявшиеся дольше `idle_after` (самого длинного периода восстановления), уже полные
+    и периодически удаляются.
+    """
+
+    def __init__(self, idle_after: timedelta, prune_every: int = 1000):
+        self.idle_after = idle_after
+        self.prune_every = prune_every
+        self._calls = 0
+
+    def hit(self, limits: list[tuple[str, BucketSpec]], cost: float = 1) -> float:
+        now = datetime.now(UTC)
+        specs = dict(limits)
+        with transaction.atomic():
+            RateLimitBucket.objects.bulk_create(
+                [RateLimitBucket(key=key, tokens=spec.capacity, updated_at=now) for key, spec in limits],
+                ignore_conflicts=True,
+            )
+            # блокируем в одном порядке, чтобы параллельные запросы не взаимоблокировались
+            rows = list(RateLimitBucket.objects.select_for_update().filter(key__in=specs).order_by('key'))
+            buckets = [TokenBucket(specs[row.key], row.tokens, row.updated_at.timestamp()) for row in rows]
+            wait = take(buckets, now.timestamp(), cost)
+            if not wait:
+                for row, bucket in zip(rows, buckets, strict=True):
+                    row.tokens, row.updated_at = bucket.tokens, now
+                RateLimitBucket.objects.bulk_update(rows, ['tokens', 'updated_at'])
+        self._calls += 1
+        if self._calls % self.prune_every == 0:
+            self.prune(now)
+        return wait
+
+    def prune(self, now: datetime | None = None) -> int:
+        deleted, _ = RateLimitBucket.objects.filter(
+            updated_at__lt=(now or datetime.now(UTC)) - self.idle_after,
+        ).delete()
+        return deleted
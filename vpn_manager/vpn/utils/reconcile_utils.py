@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import chain
+
+from asgiref.sync import sync_to_async
+from config.env_constants import RECONCILE_GRACE_PERIOD
+from django.utils import timezone
+from grpc_generated_files import account_pb2, user_pb2
+
+from vpn.managers.mutation_queue import submit_mutation
+from vpn.managers.vless_manager import XRayManager
+from vpn.models.configs import SpareVLESSClient, VLESSConfig
+from vpn.models.servers import ServerProtocol, SlotReservation, VPNServer
+from vpn.xray_api.exceptions import EmailExistsError
+from vpn.xray_api.xray_async_grpc import AsyncXrayAPI
+
+
+logger = logging.getLogger(__name__)
+
+# пара (client_id, email), по которой сравниваются пользователи Xray и конфиги в БД
+ClientKey = tuple[str, str]
+
+
+@dataclass
+class DriftReport:
+    server: VPNServer
+    missing: int = 0  # активен в БД, но Xray его не обслуживает
+    unknown: int = 0  # есть в Xray, но нет активного конфига в БД
+    skipped: int = 0  # лишние, которые не удалялись: их запись в БД может ещё создаваться
+    applied: int = 0
+    elapsed_ms: float = 0.0
+    error: str | None = None
+
+    def __str__(self):
+        if self.error:
+            return f'{self.server.name}: ошибка {self.error}'
+        return (
+            f'{self.server.name}: нет в Xray {self.missing}, лишних в Xray {self.unknown} '
+            f'(оставлено {self.skipped}), применено {self.applied} ({self.elapsed_ms:.1f} мс)'
+        )
+
+
+def live_client_key(user: user_pb2.User) -> ClientKey:
+    account = account_pb2.Account.FromString(user.account.value)
+    return account.id, user.email
+
+
+def get_expected_clients(server: VPNServer) -> set[ClientKey]:
+    rows = VLESSConfig.objects.filter(server=server, is_active=True).values_list('client_id', 'config_email')
+    # резервные клиенты пула тоже должны обслуживаться Xray
+    spares = SpareVLESSClient.objects.filter(server=server).values_list('client_id', 'config_email')
+    return {(str(client_id), email) for client_id, email in chain(rows, spares)}
+
+
+def has_active_reservations(server: VPNServer) -> bool:
+    return SlotReservation.objects.filter(server=server, expires_at__gt=timezone.now()).exists()
+
+
+def is_recent_client(email: str, now: datetime) -> bool:
+    """Создан ли клиент позже начала окна ожидания (время создания — суффикс email из `XRayManager.add_client`)."""
+    try:
+        created_at = datetime.fromisoformat(email.rsplit('_', 1)[-1])
+    except ValueError:
+        return False
+    if timezone.is_naive(created_at):
+        return False
+    return now - created_at < timedelta(seconds=RECONCILE_GRACE_PERIOD)
+
+
+def remove_unknown_clients(server: VPNServer, unknown: set[ClientKey]) -> int:
+    """Удалить лишних клиентов через очередь изменений сервера, чтобы config.json совпадал с Xray."""
+
+    def remove(mgr: XRayManager):
+        for client_id, email in unknown:
+            mgr.remove_unknown_client(client_id, email)
+
+    submit_mutation(XRayManager, server, remove)
+    return len(unknown)
+
+
+async def reconcile_server(server: VPNServer, *, dry_run: bool = False, remove_unknown: bool = False) -> DriftReport:
+    """Сверить пользователей inbound'а Xray с активными VLESS-конфигами сервера и устранить расхождения.
+
+    Недостающие пользователи добавляются только в работающий Xray через gRPC: config.json на сервере
+    остаётся источником истины при перезапуске контейнера. Лишние по умолчанию только подсчитываются;
+    с `remove_unknown` они удаляются из конфига и из Xray, кроме созданных недавно и всех, пока на сервере
+    есть действующие резервы слотов: у таких клиентов запись в БД может ещё не появиться.
+    """
+    report = DriftReport(server)
+    started = time.perf_counter()
+    address = XRayManager.api_address_for(server)
+    tag = XRayManager.inbound_tag
+    try:
+        # сначала читаем Xray, потом БД: клиент, добавленный между запросами, не окажется лишним
+        live_users = await AsyncXrayAPI.get_inbound_users(address, tag)
+        expected = await sync_to_async(get_expected_clients)(server)
+        live = {live_client_key(user) for user in live_users}
+        missing = expected - live
+        unknown = live - expected
+        report.missing, report.unknown = len(missing), len(unknown)
+
+        removable: set[ClientKey] = set()
+        if remove_unknown and unknown and not await sync_to_async(has_active_reservations)(server):
+            now = timezone.now()
+            removable = {key for key in unknown if not is_recent_client(key[1], now)}
+        report.skipped = len(unknown) - len(removable)
+
+        if not dry_run:
+            # сначала удаляем: пользователь с тем же email, но другим id, попадает в оба множества
+            if removable:
+                report.applied += await sync_to_async(remove_unknown_clients, thread_sensitive=False)(
+                    server,
+                    removable,
+                )
+            results = await asyncio.gather(
+                *(AsyncXrayAPI.add_user(address, tag, email, client_id) for client_id, email in missing),
+                return_exceptions=True,
+            )
+            report.applied += _count_applied(server, results, EmailExistsError)
+    except Exception as e:
+        logger.exception('Не удалось сверить пользователей Xray на сервере %s', server)
+        report.error = str(e)
+    report.elapsed_ms = (time.perf_counter() - started) * 1000
+    return report
+
+
+def _count_applied(server: VPNServer, results: list, ignored: type[Exception]) -> int:
+    applied = 0
+    for result in results:
+        if isinstance(result, ignored):
+            continue
+        if isinstance(result, BaseException):
+            logger.error('Ошибка применения изменения в Xray на сервере %s: %s', server, result)
+            continue
+        applied += 1
+    return applied
+
+
+async def reconcile_all(*, dry_run: bool = False, remove_unknown: bool = False) -> list[DriftReport]:
+    """Сверить все активные VLESS-сервера параллельно."""
+    servers = await sync_to_async(list)(
+        VPNServer.objects.filter(is_active=True, protocols__protocol=ServerProtocol.VLESS).distinct(),
+    )
+    return await asyncio.gather(
+        *(reconcile_server(server, dry_run=dry_run, remove_unknown=remove_unknown) for server in servers),
+    )
@@ -0,0 +1,128 @@
+import logging
+import math
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from vpn.models.configs import SpareVLESSClient, VLESSConfig
+from vpn.models.servers import ServerProtocol, VPNServer
+from vpn.utils.vless_utils import add_spare_vless_clients, remove_spare_vless_clients, spare_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RefillPlan:
+    server: VPNServer
+    spares: int  # сейчас в пуле
+    demand: int  # выдано VLESS-конфигов за окно спроса
+    low: int
+    high: int
+    to_create: int
+
+    def __str__(self):
+        return (
+            f'{self.server.name}: в пуле {self.spares}, спрос {self.demand}, '
+            f'пороги {self.low}/{self.high}, добавить {self.to_create}'
+        )
+
+
+@dataclass
+class SpareUsage:
+    hits: int  # конфиги, выданные из пула
+    misses: int  # конфиги, для которых клиент создавался на сервере
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return f'выдано из пула {self.hits}, мимо пула {self.misses} (hit rate {self.hit_rate:.0%})'
+
+
+def get_spare_usage(since: datetime) -> SpareUsage:
+    """Сколько VLESS-конфигов с `since` выдано из пула и сколько мимо него (по всем процессам)."""
+    counts = VLESSConfig.objects.filter(created_at__gte=since).aggregate(
+        hits=Count('pk', filter=Q(from_spare=True)),
+        total=Count('pk'),
+    )
+    return SpareUsage(counts['hits'], counts['total'] - counts['hits'])
+
+
+def plan_refills(
+    *,
+    demand_window: timedelta,
+    cover: timedelta,
+    min_size: int,
+    max_size: int,
+    low_ratio: float,
+) -> list[RefillPlan]:
+    """Рассчитать пополнение пула для всех активных VLESS-серверов.
+
+    Верхний порог — сколько конфигов сервер выдаёт за `cover` при спросе за последние `demand_window`,
+    в пределах [min_size, max_size]. Пул пополняется до верхнего порога, только когда опускается
+    ниже нижнего (`high * low_ratio`), и никогда не занимает больше свободных слотов сервера.
+    """
+    since = timezone.now() - demand_window
+    demand = dict(
+        VLESSConfig.objects.filter(created_at__gte=since)
+        .order_by()
+        .values('server')
+        .annotate(count=Count('pk'))
+        .values_list('server', 'count'),
+    )
+    spares = dict(
+        SpareVLESSClient.objects.order_by().values('server').annotate(count=Count('pk')).values_list('server', 'count'),
+    )
+    servers = VPNServer.objects.filter(is_active=True, protocols__protocol=ServerProtocol.VLESS).distinct().with_load()
+
+    plans = []
+    for server in servers:
+        server_demand = demand.get(server.pk, 0)
+        server_spares = spares.get(server.pk, 0)
+        high = min(max(math.ceil(server_demand * (cover / demand_window)), min_size), max_size)
+        low = math.ceil(high * low_ratio)
+        to_create = 0
+        if server_spares < low:
+            # free_slots уже учитывает резервных клиентов: вместе с ними не выходим за max_configs
+            to_create = max(0, min(high - server_spares, server.free_slots))
+        plans.append(RefillPlan(server, server_spares, server_demand, low, high, to_create))
+    return plans
+
+
+def refill_server(plan: RefillPlan) -> int:
+    """Добавить клиентов в Xray одной пачкой и записать их в пул.
+
+    Если записать клиентов в БД не удалось, они удаляются с сервера: иначе их никто не выдаст.
+    """
+    if plan.to_create <= 0:
+        return 0
+    started = time.perf_counter()
+    clients = add_spare_vless_clients(plan.server, plan.to_create)
+    try:
+        SpareVLESSClient.objects.bulk_create(
+            SpareVLESSClient(server=plan.server, client_id=client_id, config_email=email)
+            for client_id, email in clients
+        )
+    except Exception:
+        remove_spare_vless_clients(plan.server, [client_id for client_id, _ in clients])
+        raise
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    spare_stats.record_refill(len(clients), elapsed_ms)
+    logger.info('Пул сервера %s пополнен на %s клиентов за %.1f мс', plan.server, len(clients), elapsed_ms)
+    return len(clients)
+
+
+def fill_spare_clients(**plan_options) -> list[RefillPlan]:
+    plans = plan_refills(**plan_options)
+    for plan in plans:
+        try:
+            refill_server(plan)
+        except Exception:
+            logger.exception('Не удалось пополнить пул резервных клиентов на сервере %s', plan.server)
+    return plans
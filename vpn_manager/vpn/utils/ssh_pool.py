@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from config.env_constants import SSH_KEEPALIVE_INTERVAL, SSH_POOL_IDLE_TIMEOUT, SSH_POOL_MAX_SIZE
+from paramiko.ssh_exception import SSHException
+
+from vpn.models.servers import VPNServer
+from vpn.utils.ssh_utils import SSHClient, get_ssh_client
+
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых соединение считается сломанным и не возвращается в пул
+CONNECTION_ERRORS = (SSHException, EOFError, OSError)
+
+PoolKey = tuple[int, str, int, str]
+
+
+class SSHPool:
+    """Пул аутентифицированных SSH-соединений с открытым SFTP-каналом для каждого VPN-сервера.
+
+    Соединение выдаётся в монопольное пользование через `acquire`/`release` (или `connection`),
+    после чего возвращается в пул. Транспорт держится живым keepalive-пакетами, перед выдачей
+    проверяется его состояние, а простаивающие дольше `idle_timeout` соединения закрываются.
+    """
+
+    def __init__(self, max_size: int, idle_timeout: float, keepalive_interval: int):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._cond = threading.Condition()
+        self._idle: dict[PoolKey, list[tuple[SSHClient, float]]] = defaultdict(list)
+        self._in_use: dict[PoolKey, int] = defaultdict(int)
+        self._reaper: threading.Thread | None = None
+
+    @staticmethod
+    def _key(server: VPNServer) -> PoolKey:
+        # хост и порт входят в ключ, чтобы смена адреса сервера в админке не отдавала старое соединение
+        return server.pk, server.host, server.ssh_port, server.ssh_user
+
+    @staticmethod
+    def is_healthy(ssh: SSHClient) -> bool:
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        sftp = getattr(ssh, 'sftp_client', None)
+        return sftp is not None and not sftp.get_channel().closed
+
+    def _connect(self, server: VPNServer) -> SSHClient:
+        ssh = get_ssh_client(server)
+        try:
+            ssh.get_transport().set_keepalive(self.keepalive_interval)  # type: ignore[union-attr]
+            ssh.sftp_client = ssh.open_sftp()
+        except CONNECTION_ERRORS:
+            ssh.close()
+            raise
+        logger.info('Открыто SSH-соединение с сервером %s', server)
+        return ssh
+
+    @staticmethod
+    def _discard(ssh: SSHClient):
+        try:
+            sftp = getattr(ssh, 'sftp_client', None)
+            if sftp is not None:
+                sftp.close()
+            ssh.close()
+        except CONNECTION_ERRORS:
+            logger.debug('Ошибка при закрытии SSH-соединения', exc_info=True)
+
+    def acquire(self, server: VPNServer) -> SSHClient:
+        """Выдать соединение с сервером: свободное из пула или новое, если лимит позволяет."""
+        key = self._key(server)
+        with self._cond:
+            self._reap_idle_locked()
+            while True:
+                while self._idle[key]:
+                    ssh, _ = self._idle[key].pop()
+                    if self.is_healthy(ssh):
+                        self._in_use[key] += 1
+                        return ssh
+                    logger.info('SSH-соединение с сервером %s разорвано, переподключаемся', server)
+                    self._discard(ssh)
+                if self._in_use[key] < self.max_size:
+                    self._in_use[key] += 1
+                    break
+                self._cond.wait()
+            self._ensure_reaper_locked()
+
+        # подключаемся вне блокировки, чтобы медленный handshake не задерживал другие сервера
+        try:
+            return self._connect(server)
+        except BaseException:
+            with self._cond:
+                self._in_use[key] -= 1
+                self._cond.notify_all()
+            raise
+
+    def release(self, server: VPNServer, ssh: SSHClient, *, broken: bool = False):
+        """Вернуть соединение в пул. Сломанные соединения закрываются."""
+        key = self._key(server)
+        with self._cond:
+            self._in_use[key] -= 1
+            if broken or not self.is_healthy(ssh):
+                self._discard(ssh)
+            else:
+                self._idle[key].append((ssh, time.monotonic()))
+            self._cond.notify_all()
+
+    @contextmanager
+    def connection(self, server: VPNServer) -> Iterator[SSHClient]:
+        ssh = self.acquire(server)
+        broken = False
+        try:
+            yield ssh
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(server, ssh, broken=broken)
+
+    def _reap_idle_locked(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for key, idle in self._idle.items():
+            if not idle:
+                continue
+            expired = [ssh for ssh, released_at in idle if released_at < deadline]
+            if expired:
+                self._idle[key] = [(ssh, released_at) for ssh, released_at in idle if released_at >= deadline]
+                for ssh in expired:
+                    self._discard(ssh)
+                logger.info('Закрыто %s простаивающих SSH-соединений с %s', len(expired), key[1])
+
+    def reap_idle(self):
+        with self._cond:
+            self._reap_idle_locked()
+
+    def _ensure_reaper_locked(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(target=self._reaper_loop, name='ssh-pool-reaper', daemon=True)
+        self._reaper.start()
+
+    def _reaper_loop(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            self.reap_idle()
+
+    def close_all(self):
+        with self._cond:
+            for idle in self._idle.values():
+                for ssh, _ in idle:
+                    self._discard(ssh)
+            self._idle.clear()
+
+
+ssh_pool = SSHPool(
+    max_size=SSH_POOL_MAX_SIZE,
+    idle_timeout=SSH_POOL_IDLE_TIMEOUT,
+    keepalive_interval=SSH_KEEPALIVE_INTERVAL,
+)
@@ -1,10 +1,23 @@
+import io
+import logging
+import shlex
+import time
+import uuid
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+
 import paramiko
-from config.env_constants import SSH_KEY_PATH
+from config.env_constants import SSH_CONNECT_TIMEOUT, SSH_KEY_PATH
 from paramiko.ssh_exception import SSHException
 
 from vpn.models.servers import VPNServer
 
 
+logger = logging.getLogger(__name__)
+
+
 class SSHClient(paramiko.SSHClient):
     sftp_client: paramiko.SFTPClient
 
@@ -12,7 +25,13 @@ class SSHClient(paramiko.SSHClient):
 def get_ssh_client(server: VPNServer) -> SSHClient:
     ssh = SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(server.host, username=server.ssh_user, key_filename=SSH_KEY_PATH)
+    ssh.connect(
+        server.host,
+        port=server.ssh_port,
+        username=server.ssh_user,
+        key_filename=SSH_KEY_PATH,
+        timeout=SSH_CONNECT_TIMEOUT,
+    )
     return ssh
 
 
@@ -25,17 +44,107 @@ def execute_ssh_command(ssh_client: SSHClient, command: str) -> str:
     return output
 
 
-def get_file_from_container(ssh_client: SSHClient, container: str, local_path: str, container_path: str):
-    temp_server_path = f'/tmp/{local_path.split("/")[-1]}'
+def _remote_temp_path() -> str:
+    # уникальное имя, чтобы параллельные менеджеры не перезаписывали файлы друг друга
+    return f'/tmp/vpn-bot-{uuid.uuid4().hex}'  # noqa: S108
+
+
+def get_file_from_container(ssh_client: SSHClient, container: str, container_path: str) -> bytes:
+    temp_server_path = _remote_temp_path()
     command = f'sudo docker cp {container}:{container_path} {temp_server_path}'
     execute_ssh_command(ssh_client, command)
-    ssh_client.sftp_client.get(temp_server_path, local_path)
-    execute_ssh_command(ssh_client, f'sudo shred -u {temp_server_path}')
+    buf = io.BytesIO()
+    try:
+        ssh_client.sftp_client.getfo(temp_server_path, buf)
+    finally:
+        execute_ssh_command(ssh_client, f'sudo shred -u {temp_server_path}')
+    return buf.getvalue()
 
 
-def put_file_to_container(ssh_client: SSHClient, container: str, local_path: str, container_path: str):
-    temp_server_path = f'/tmp/{local_path.split("/")[-1]}'
-    ssh_client.sftp_client.put(local_path, temp_server_path)
-    command = f'sudo docker cp {temp_server_path} {container}:{container_path}'
-    execute_ssh_command(ssh_client, command)
-    execute_ssh_command(ssh_client, f'sudo shred -u {temp_server_path}')
+def put_file_to_container(ssh_client: SSHClient, container: str, data: bytes, container_path: str):
+    temp_server_path = _remote_temp_path()
+    ssh_client.sftp_client.putfo(io.BytesIO(data), temp_server_path)
+    try:
+        command = f'sudo docker cp {temp_server_path} {container}:{container_path}'
+        execute_ssh_command(ssh_client, command)
+    finally:
+        execute_ssh_command(ssh_client, f'sudo shred -u {temp_server_path}')
+
+
+def read_file_from_container(ssh_client: SSHClient, container: str, container_path: str) -> bytes:
+    """Прочитать файл из контейнера за один exec-запрос, без временного файла на хосте."""
+    command = f'sudo docker exec {container} cat {shlex.quote(container_path)}'
+    _, stdout, stderr = ssh_client.exec_command(command)
+    data = stdout.read()
+    if stdout.channel.recv_exit_status() != 0:
+        raise SSHException(f'Ошибка выполнения команды {command}: {stderr.read().decode()}')
+    return data
+
+
+def write_file_to_container(ssh_client: SSHClient, container: str, data: bytes, container_path: str):
+    """Записать файл в контейнер за один exec-запрос, передавая содержимое через stdin.
+
+    Данные сначала пишутся во временный файл рядом с целевым и копируются поверх него
+    только если размер совпал, чтобы оборванная передача не испортила конфиг.
+    Копирование через `cat` сохраняет права и inode исходного файла.
+    """
+    path = shlex.quote(container_path)
+    tmp = shlex.quote(f'{container_path}.tmp')
+    script = (
+        f'cat > {tmp} && [ "$(wc -c < {tmp})" -eq {len(data)} ] && cat {tmp} > {path}; '
+        f'status=$?; rm -f {tmp}; exit $status'
+    )
+    command = f'sudo docker exec -i {container} sh -c {shlex.quote(script)}'
+    stdin, stdout, stderr = ssh_client.exec_command(command)
+    stdin.write(data)
+    stdin.channel.shutdown_write()
+    if stdout.channel.recv_exit_status() != 0:
+        raise SSHException(f'Ошибка записи {container_path} в контейнер {container}: {stderr.read().decode()}')
+
+
+def execute_container_script(ssh_client: SSHClient, container: str, script: str) -> str:
+    """Выполнить shell-скрипт внутри контейнера за один exec-запрос.
+
+    Скрипт передаётся через stdin, поэтому ключи из него не попадают в список процессов хоста.
+    """
+    command = f'sudo docker exec -i {container} sh -s'
+    stdin, stdout, stderr = ssh_client.exec_command(command)
+    stdin.write(script.encode())
+    stdin.channel.shutdown_write()
+    output = stdout.read().decode()
+    if stdout.channel.recv_exit_status() != 0:
+        raise SSHException(f'Ошибка выполнения скрипта в контейнере {container}: {stderr.read().decode()}')
+    return output
+
+
+@dataclass
+class TransferTiming:
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+# накопленное время передачи файлов по (сервер, режим, направление) для сравнения режимов
+transfer_timings: dict[tuple[str, str, str], TransferTiming] = defaultdict(TransferTiming)
+
+
+@contextmanager
+def timed_transfer(server: VPNServer, mode: str, direction: str, path: str) -> Iterator[None]:
+    started = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        # неудачные передачи тоже учитываем: медленный обрыв по таймауту важен не меньше успешной записи
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        timing = transfer_timings[server.name, mode, direction]
+        timing.count += 1
+        timing.total_ms += elapsed_ms
+        timing.max_ms = max(timing.max_ms, elapsed_ms)
+        status = 'не удалась за' if failed else 'заняла'
+        logger.info('Передача %s (%s, %s) на %s %s %.1f мс', path, direction, mode, server.name, status, elapsed_ms)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.utils import timezone
+
+from vpn.managers.vless_manager import XRayManager
+from vpn.models.configs import VLESSConfig
+from vpn.models.servers import ServerProtocol, VPNServer
+from vpn.models.stats import TrafficStat
+from vpn.xray_api.xray_async_grpc import AsyncXrayAPI
+
+
+logger = logging.getLogger(__name__)
+
+# Xray называет счётчики пользователей 'user>>>{email}>>>traffic>>>{uplink|downlink}'
+USER_STATS_PATTERN = 'user>>>'
+
+Usage = dict[str, tuple[int, int]]
+
+
+def parse_user_traffic(stats: dict[str, int]) -> Usage:
+    """Сгруппировать счётчики QueryStats по email в пары (uplink, downlink)."""
+    usage: dict[str, list[int]] = {}
+    for name, value in stats.items():
+        parts = name.split('>>>')
+        if len(parts) != 4 or parts[0] != 'user' or parts[2] != 'traffic':  # noqa: PLR2004
+            continue
+        counters = usage.setdefault(parts[1], [0, 0])
+        if parts[3] == 'uplink':
+            counters[0] += value
+        elif parts[3] == 'downlink':
+            counters[1] += value
+    return {email: (up, down) for email, (up, down) in usage.items() if up or down}
+
+
+async def fetch_server_traffic(server: VPNServer) -> Usage:
+    """Забрать и обнулить счётчики всех пользователей сервера одним запросом QueryStats."""
+    stats = await AsyncXrayAPI.query_stats(XRayManager.api_address_for(server), USER_STATS_PATTERN, reset=True)
+    return parse_user_traffic(stats)
+
+
+def merge_usage(*usages: Usage) -> Usage:
+    merged: dict[str, tuple[int, int]] = {}
+    for usage in usages:
+        for email, (up, down) in usage.items():
+            prev_up, prev_down = merged.get(email, (0, 0))
+            merged[email] = (prev_up + up, prev_down + down)
+    return merged
+
+
+# забранный с сервера трафик, который не удалось записать в БД: добавляется к следующему проходу
+_unstored: dict[int, Usage] = {}
+
+
+async def collect_server_traffic(server: VPNServer) -> int:
+    """Забрать трафик сервера (со сбросом счётчиков) и записать его в БД.
+
+    Если запись не удалась, трафик остаётся в памяти процесса и записывается вместе со следующим проходом.
+    """
+    usage = merge_usage(_unstored.pop(server.pk, {}), await fetch_server_traffic(server))
+    try:
+        return await sync_to_async(store_server_traffic)(server, usage)
+    except Exception:
+        _unstored[server.pk] = usage
+        raise
+
+
+def _add_to_buckets(config_ids: dict[str, int], usage: Usage, period: str, bucket: datetime):
+    existing = {
+        stat.config_id: stat  # type: ignore[attr-defined]
+        for stat in TrafficStat.objects.select_for_update().filter(
+            config_id__in=config_ids.values(),
+            period=period,
+            bucket=bucket,
+        )
+    }
+    to_create = []
+    for email, (uplink, downlink) in usage.items():
+        config_id = config_ids[email]
+        stat = existing.get(config_id)
+        if stat is None:
+            to_create.append(
+                TrafficStat(config_id=config_id, period=period, bucket=bucket, uplink=uplink, downlink=downlink),
+            )
+        else:
+            stat.uplink += uplink
+            stat.downlink += downlink
+    TrafficStat.objects.bulk_update(existing.values(), ['uplink', 'downlink'])
+    TrafficStat.objects.bulk_create(to_create)
+
+
+def store_server_traffic(server: VPNServer, usage: Usage, now: datetime | None = None) -> int:
+    """Добавить приращения трафика в часовые и дневные корзины. Возвращает число учтённых конфигов."""
+    config_ids = dict(
+        VLESSConfig.objects.filter(server=server, config_email__in=usage.keys()).values_list('config_email', 'pk'),
+    )
+    unknown = usage.keys() - config_ids.keys()
+    if unknown:
+        logger.warning('На сервере %s есть трафик %s пользователей без конфига в БД', server, len(unknown))
+    usage = {email: counters for email, counters in usage.items() if email in config_ids}
+    if not usage:
+        return 0
+
+    local_now = timezone.localtime(now or timezone.now())
+    hour = local_now.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    with transaction.atomic():
+        _add_to_buckets(config_ids, usage, TrafficStat.HOUR, hour)
+        _add_to_buckets(config_ids, usage, TrafficStat.DAY, day)
+    return len(usage)
+
+
+def prune_hourly_traffic(retention: timedelta) -> int:
+    """Удалить часовые корзины старше `retention`: дневные агрегаты при этом остаются."""
+    deleted, _ = TrafficStat.objects.filter(period=TrafficStat.HOUR, bucket__lt=timezone.now() - retention).delete()
+    return deleted
+
+
+async def collect_traffic() -> int:
+    """Один проход сбора статистики по всем активным VLESS-серверам параллельно."""
+    started = time.perf_counter()
+    servers = await sync_to_async(list)(
+        VPNServer.objects.filter(is_active=True, protocols__protocol=ServerProtocol.VLESS).distinct(),
+    )
+    results = await asyncio.gather(*(collect_server_traffic(server) for server in servers), return_exceptions=True)
+
+    total = 0
+    for server, result in zip(servers, results, strict=True):
+        if isinstance(result, BaseException):
+            logger.error('Не удалось собрать статистику с сервера %s: %s', server, result)
+            continue
+        total += result
+
+    logger.info(
+        'Статистика трафика собрана: %s серверов, %s конфигов за %.1f мс',
+        len(servers),
+        total,
+        (time.perf_counter() - started) * 1000,
+    )
+    return total
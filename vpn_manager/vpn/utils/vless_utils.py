@@ -1,9 +1,43 @@
+import threading
+import uuid
+from dataclasses import dataclass, field
+
+from vpn.managers.mutation_queue import submit_mutation
 from vpn.managers.vless_manager import XRayManager
-from vpn.models.servers import VPNServer
+from vpn.models.servers import ServerProtocol, VPNServer
+
+
+@dataclass
+class SparePoolStats:
+    """Счётчики пополнений пула резервных VLESS-клиентов в текущем процессе.
+
+    Доля выдач из пула считается по БД (`VLESSConfig.from_spare`), потому что выдают конфиги другие процессы.
+    """
+
+    refills: int = 0
+    refilled_clients: int = 0
+    refill_ms: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record_refill(self, clients: int, elapsed_ms: float):
+        with self._lock:
+            self.refills += 1
+            self.refilled_clients += clients
+            self.refill_ms += elapsed_ms
+
+    @property
+    def avg_refill_ms(self) -> float:
+        return self.refill_ms / self.refills if self.refills else 0.0
+
+    def __str__(self):
+        return f'пополнений {self.refills} на {self.refilled_clients} клиентов, в среднем {self.avg_refill_ms:.1f} мс'
+
+
+spare_stats = SparePoolStats()
 
 
 def generate_vless_config(username: str, server: VPNServer) -> tuple[str, str, str]:
-    with XRayManager(server) as mgr:
+    def add(mgr: XRayManager) -> tuple[str, str, str]:
         client_id, client_name = mgr.add_client(username)
         vless_url = mgr.get_vless_url_template().format(
             client_id=client_id,
@@ -11,20 +45,41 @@ def generate_vless_config(username: str, server: VPNServer) -> tuple[str, str, s
             public_key=mgr.server_protocol.public_key,
             client_name=client_name,
         )
-    return client_id, client_name, vless_url
+        return client_id, client_name, vless_url
+
+    return submit_mutation(XRayManager, server, add)
 
 
 def remove_vless_config(client_id: str, server: VPNServer):
-    with XRayManager(server) as mgr:
-        mgr.remove_client(client_id)
+    submit_mutation(XRayManager, server, lambda mgr: mgr.remove_client(client_id))
 
 
 def get_vless_url_by_id(client_id: str, client_name: str, server: VPNServer) -> tuple[str, str]:
-    with XRayManager(server, should_restart=False) as mgr:
-        vless_url = mgr.get_vless_url_template().format(
-            client_id=client_id,
-            server_ip_address=server.host,
-            public_key=mgr.server_protocol.public_key,
-            client_name=client_name,
-        )
+    # все данные для ссылки есть в БД, поэтому к серверу не подключаемся
+    server_protocol = server.protocols.get(protocol=ServerProtocol.VLESS)
+    vless_url = XRayManager.get_vless_url_template().format(
+        client_id=client_id,
+        server_ip_address=server.host,
+        public_key=server_protocol.public_key,
+        client_name=client_name,
+    )
     return client_id, vless_url
+
+
+def remove_spare_vless_clients(server: VPNServer, client_ids: list[str]):
+    """Удалить из Xray резервных клиентов, которых не удалось записать в пул, одной записью конфига."""
+
+    def remove(mgr: XRayManager):
+        for client_id in client_ids:
+            mgr.remove_client(client_id)
+
+    submit_mutation(XRayManager, server, remove)
+
+
+def add_spare_vless_clients(server: VPNServer, count: int) -> list[tuple[str, str]]:
+    """Добавить в Xray `count` ещё не выданных клиентов одной записью конфига и вернуть их (client_id, email)."""
+
+    def add(mgr: XRayManager) -> list[tuple[str, str]]:
+        return [mgr.add_client(f'spare_{uuid.uuid4().hex[:8]}') for _ in range(count)]
+
+    return submit_mutation(XRayManager, server, add)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any
+
+import grpc
+from config.env_constants import XRAY_GRPC_KEEPALIVE_MS, XRAY_GRPC_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', XRAY_GRPC_KEEPALIVE_MS),
+    ('grpc.keepalive_timeout_ms', 10_000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.initial_reconnect_backoff_ms', 500),
+    ('grpc.max_reconnect_backoff_ms', 10_000),
+]
+
+
+@dataclass
+class ChannelStats:
+    created: int = 0
+    reused: int = 0
+    reconnects: int = 0
+
+
+class ChannelRegistry:
+    """Реестр долгоживущих gRPC-каналов к Xray, по одному на адрес API.
+
+    Каналы создаются лениво, поддерживаются keepalive-пингами и разделяются между всеми
+    стабами (HandlerService, StatsService). Каждый вызов идёт с дедлайном, а при
+    UNAVAILABLE канал пересоздаётся и вызов повторяется один раз.
+    """
+
+    def __init__(self, options: list[tuple[str, Any]], timeout: float):
+        self.options = options
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._channels: dict[str, grpc.Channel] = {}
+        self._stubs: dict[tuple[str, type], Any] = {}
+        self.stats: dict[str, ChannelStats] = defaultdict(ChannelStats)
+
+    def channel(self, address: str) -> grpc.Channel:
+        with self._lock:
+            channel = self._channels.get(address)
+            if channel is None:
+                channel = grpc.insecure_channel(address, options=self.options)
+                self._channels[address] = channel
+                self.stats[address].created += 1
+            else:
+                self.stats[address].reused += 1
+            return channel
+
+    def stub(self, address: str, stub_cls: type) -> Any:
+        channel = self.channel(address)
+        with self._lock:
+            stub = self._stubs.get((address, stub_cls))
+            if stub is None:
+                stub = self._stubs[address, stub_cls] = stub_cls(channel)
+            return stub
+
+    def invalidate(self, address: str):
+        with self._lock:
+            channel = self._channels.pop(address, None)
+            self._stubs = {key: stub for key, stub in self._stubs.items() if key[0] != address}
+            if channel is not None:
+                self.stats[address].reconnects += 1
+        if channel is not None:
+            channel.close()
+
+    def call(self, address: str, stub_cls: type, method: str, request, *, timeout: float | None = None):
+        """Вызвать унарный метод стаба на канале `address` с дедлайном."""
+        timeout = timeout or self.timeout
+        try:
+            return getattr(self.stub(address, stub_cls), method)(request, timeout=timeout)
+        except grpc.RpcError as rpc_err:
+            if rpc_err.code() != grpc.StatusCode.UNAVAILABLE:  # type: ignore[attr-defined]
+                raise
+            logger.warning('gRPC-канал к %s недоступен, переподключаемся', address)
+            self.invalidate(address)
+        return getattr(self.stub(address, stub_cls), method)(request, timeout=timeout)
+
+    def close_all(self):
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+            self._stubs.clear()
+        for channel in channels:
+            channel.close()
+
+
+class AsyncChannelRegistry:
+    """Асинхронный (grpc.aio) аналог `ChannelRegistry` для вызовов из event loop бота.
+
+    Каналы grpc.aio привязаны к event loop, в котором созданы, поэтому при смене loop
+    (например, повторный `asyncio.run` в management-команде) реестр создаёт их заново.
+    """
+
+    def __init__(self, options: list[tuple[str, Any]], timeout: float):
+        self.options = options
+        self.timeout = timeout
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._channels: dict[str, grpc.aio.Channel] = {}
+        self._stubs: dict[tuple[str, type], Any] = {}
+        self.stats: dict[str, ChannelStats] = defaultdict(ChannelStats)
+
+    def channel(self, address: str) -> grpc.aio.Channel:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._channels.clear()
+            self._stubs.clear()
+        channel = self._channels.get(address)
+        if channel is None:
+            channel = self._channels[address] = grpc.aio.insecure_channel(address, options=self.options)
+            self.stats[address].created += 1
+        else:
+            self.stats[address].reused += 1
+        return channel
+
+    def stub(self, address: str, stub_cls: type) -> Any:
+        channel = self.channel(address)
+        stub = self._stubs.get((address, stub_cls))
+        if stub is None:
+            stub = self._stubs[address, stub_cls] = stub_cls(channel)
+        return stub
+
+    async def invalidate(self, address: str):
+        channel = self._channels.pop(address, None)
+        self._stubs = {key: stub for key, stub in self._stubs.items() if key[0] != address}
+        if channel is not None:
+            self.stats[address].reconnects += 1
+            await channel.close()
+
+    async def call(self, address: str, stub_cls: type, method: str, request, *, timeout: float | None = None):
+        timeout = timeout or self.timeout
+        try:
+            return await getattr(self.stub(address, stub_cls), method)(request, timeout=timeout)
+        except grpc.aio.AioRpcError as rpc_err:
+            if rpc_err.code() != grpc.StatusCode.UNAVAILABLE:
+                raise
+            logger.warning('gRPC-канал к %s недоступен, переподключаемся', address)
+            await self.invalidate(address)
+        return await getattr(self.stub(address, stub_cls), method)(request, timeout=timeout)
+
+    async def close_all(self):
+        channels = list(self._channels.values())
+        self._channels.clear()
+        self._stubs.clear()
+        await asyncio.gather(*(channel.close() for channel in channels))
+
+
+xray_channels = ChannelRegistry(CHANNEL_OPTIONS, XRAY_GRPC_TIMEOUT)
+xray_aio_channels = AsyncChannelRegistry(CHANNEL_OPTIONS, XRAY_GRPC_TIMEOUT)
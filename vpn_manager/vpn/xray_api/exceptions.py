@@ -13,3 +13,9 @@ class InboundTagNotFoundError(XrayError):
     def __init__(self, detail, inbound_tag: str):
         super().__init__(detail)
         self.inbound_tag = inbound_tag
+
+
+class UserNotFoundError(XrayError):
+    def __init__(self, detail, email: str):
+        super().__init__(detail)
+        self.email = email
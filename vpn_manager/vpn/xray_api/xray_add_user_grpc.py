@@ -1,15 +1,56 @@
+from typing import NoReturn
+
 import grpc
 from google.protobuf.message import Message
 from grpc_generated_files import account_pb2, handler_pb2, handler_pb2_grpc, typed_message_pb2, user_pb2
 
-from .exceptions import EmailExistsError, InboundTagNotFoundError, XrayError
+from .channels import xray_channels
+from .exceptions import EmailExistsError, InboundTagNotFoundError, UserNotFoundError, XrayError
 
 
 def to_typed_message(message: Message) -> typed_message_pb2.TypedMessage:
     return typed_message_pb2.TypedMessage(type=message.DESCRIPTOR.full_name, value=message.SerializeToString())
 
 
+def build_vless_user(email: str, user_id: str, level: int = 0) -> user_pb2.User:
+    return user_pb2.User(
+        email=email,
+        level=level,
+        account=to_typed_message(
+            account_pb2.Account(
+                id=user_id,
+                flow='xtls-rprx-vision',
+            ),
+        ),
+    )
+
+
+def raise_xray_error(rpc_err: grpc.RpcError, inbound_tag: str, email: str) -> NoReturn:
+    """Преобразует ошибку gRPC от Xray в исключение из `exceptions`."""
+    detail = rpc_err.details() or ''  # type: ignore[attr-defined]
+    if detail.endswith(f'User {email} already exists.'):
+        raise EmailExistsError(detail, email) from rpc_err
+    if detail.endswith(f'User {email} not found.'):
+        raise UserNotFoundError(detail, email) from rpc_err
+    if detail.endswith(f'handler not found: {inbound_tag}'):
+        raise InboundTagNotFoundError(detail, inbound_tag) from rpc_err
+    raise XrayError(detail) from rpc_err
+
+
 class XrayAPI:
+    @staticmethod
+    def alter_inbound(server_address: str, inbound_tag: str, operation: Message, email: str) -> None:
+        """Применяет операцию над пользователями inbound'а через переиспользуемый канал."""
+        try:
+            xray_channels.call(
+                server_address,
+                handler_pb2_grpc.HandlerServiceStub,
+                'AlterInbound',
+                handler_pb2.AlterInboundRequest(tag=inbound_tag, operation=to_typed_message(operation)),
+            )
+        except grpc.RpcError as rpc_err:
+            raise_xray_error(rpc_err, inbound_tag, email)
+
     @staticmethod
     def add_user(
         server_address: str,
@@ -19,35 +60,10 @@ class XrayAPI:
         level: int = 0,
     ) -> None:
         """Добавляет пользователя (adu) в указанный inbound Xray через gRPC API."""
+        user = build_vless_user(email, user_id, level)
+        XrayAPI.alter_inbound(server_address, inbound_tag, handler_pb2.AddUserOperation(user=user), email)
 
-        # Подключаемся к gRPC API Xray
-        channel = grpc.insecure_channel(server_address)
-        stub = handler_pb2_grpc.HandlerServiceStub(channel)
-
-        user = user_pb2.User(
-            email=email,
-            level=level,
-            account=to_typed_message(
-                account_pb2.Account(
-                    id=user_id,
-                    flow='xtls-rprx-vision',
-                ),
-            ),
-        )
-
-        try:
-            stub.AlterInbound(
-                handler_pb2.AlterInboundRequest(
-                    tag=inbound_tag,
-                    operation=to_typed_message(handler_pb2.AddUserOperation(user=user)),
-                ),
-            )
-        except grpc.RpcError as rpc_err:
-            detail = rpc_err.details() or ''
-            if detail.endswith(f'User {email} already exists.'):
-                raise EmailExistsError(detail, email) from rpc_err
-            if detail.endswith(f'handler not found: {inbound_tag}'):
-                raise InboundTagNotFoundError(detail, inbound_tag) from rpc_err
-            raise XrayError(detail) from rpc_err
-        finally:
-            channel.close()
+    @staticmethod
+    def remove_user(server_address: str, inbound_tag: str, email: str) -> None:
+        """Удаляет пользователя (rmu) из указанного inbound Xray через gRPC API без перезапуска."""
+        XrayAPI.alter_inbound(server_address, inbound_tag, handler_pb2.RemoveUserOperation(email=email), email)
@@ -0,0 +1,87 @@
+import grpc
+from google.protobuf.message import Message
+from grpc_generated_files import command_pb2, command_pb2_grpc, handler_pb2, handler_pb2_grpc, user_pb2
+
+from .channels import xray_aio_channels
+from .xray_add_user_grpc import build_vless_user, raise_xray_error, to_typed_message
+
+
+class AsyncXrayAPI:
+    """Асинхронный клиент Xray API на grpc.aio.
+
+    Повторяет `XrayAPI`, но вызывается прямо из event loop бота, поэтому запросы
+    к нескольким серверам можно выполнять параллельно через `asyncio.gather`
+    без потоков `sync_to_async`.
+    """
+
+    @staticmethod
+    async def alter_inbound(server_address: str, inbound_tag: str, operation: Message, email: str) -> None:
+        try:
+            await xray_aio_channels.call(
+                server_address,
+                handler_pb2_grpc.HandlerServiceStub,
+                'AlterInbound',
+                handler_pb2.AlterInboundRequest(tag=inbound_tag, operation=to_typed_message(operation)),
+            )
+        except grpc.aio.AioRpcError as rpc_err:
+            raise_xray_error(rpc_err, inbound_tag, email)
+
+    @staticmethod
+    async def add_user(server_address: str, inbound_tag: str, email: str, user_id: str, level: int = 0) -> None:
+        """Добавляет пользователя (adu) в указанный inbound Xray."""
+        user = build_vless_user(email, user_id, level)
+        await AsyncXrayAPI.alter_inbound(server_address, inbound_tag, handler_pb2.AddUserOperation(user=user), email)
+
+    @staticmethod
+    async def remove_user(server_address: str, inbound_tag: str, email: str) -> None:
+        """Удаляет пользователя (rmu) из указанного inbound Xray."""
+        operation = handler_pb2.RemoveUserOperation(email=email)
+        await AsyncXrayAPI.alter_inbound(server_address, inbound_tag, operation, email)
+
+    @staticmethod
+    async def get_inbound_users(server_address: str, inbound_tag: str) -> list[user_pb2.User]:
+        """Возвращает всех пользователей, которых Xray сейчас обслуживает в inbound'е."""
+        try:
+            resp = await xray_aio_channels.call(
+                server_address,
+                handler_pb2_grpc.HandlerServiceStub,
+                'GetInboundUsers',
+                handler_pb2.GetInboundUserRequest(tag=inbound_tag),
+            )
+        except grpc.aio.AioRpcError as rpc_err:
+            raise_xray_error(rpc_err, inbound_tag, '')
+        return list(resp.users)
+
+    @staticmethod
+    async def get_inbound_users_count(server_address: str, inbound_tag: str) -> int:
+        try:
+            resp = await xray_aio_channels.call(
+                server_address,
+                handler_pb2_grpc.HandlerServiceStub,
+                'GetInboundUsersCount',
+                handler_pb2.GetInboundUserRequest(tag=inbound_tag),
+            )
+        except grpc.aio.AioRpcError as rpc_err:
+            raise_xray_error(rpc_err, inbound_tag, '')
+        return resp.count
+
+    @staticmethod
+    async def query_stats(server_address: str, pattern: str, *, reset: bool = False) -> dict[str, int]:
+        """Возвращает счётчики, имя которых содержит `pattern`, одним запросом (опционально обнуляя их)."""
+        resp = await xray_aio_channels.call(
+            server_address,
+            command_pb2_grpc.StatsServiceStub,
+            'QueryStats',
+            command_pb2.QueryStatsRequest(pattern=pattern, reset=reset),
+        )
+        return {stat.name: stat.value for stat in resp.stat}
+
+    @staticmethod
+    async def get_stats_online(server_address: str, email: str) -> int:
+        resp = await xray_aio_channels.call(
+            server_address,
+            command_pb2_grpc.StatsServiceStub,
+            'GetStatsOnline',
+            command_pb2.GetStatsRequest(name=f'user>>>{email}>>>online'),
+        )
+        return resp.stat.value
@@ -1,12 +1,8 @@
-import grpc
 from grpc_generated_files import command_pb2, command_pb2_grpc
 
+from .channels import xray_channels
 
-def get_stats_online(host, user):
-    channel = grpc.insecure_channel(host)
-    stub = command_pb2_grpc.StatsServiceStub(channel)
 
+def get_stats_online(host, user):
     req = command_pb2.GetStatsRequest(name=f'user>>>{user}>>>online')
-
-    resp = stub.GetStatsOnline(req)
-    return resp
+    return xray_channels.call(host, command_pb2_grpc.StatsServiceStub, 'GetStatsOnline', req)